@@ -252,6 +252,7 @@ const { app, h, toast, confettiBurst, installUmami, track } = window.EV_UI;
 
     const data = await ensurePackData(packId);
     const cards = getLaunchCards(data.cards?.cards || []);
+    const cardImages = await window.EV_LOADER.loadCardImages(packDir, cards.map(c => c.id));
 
     window.EV_STORE.setPrefs({ lastPack: packId });
 
@@ -283,7 +284,7 @@ const { app, h, toast, confettiBurst, installUmami, track } = window.EV_UI;
             const cardImage = `packs/${packDir}/${getCardImage(c)}`;
             const t = h("div",{class:"card-thumb", onclick:()=>location.hash=`#/compose?${qs({pack:packId, card:c.id})}`},[
               h("div",{class:"card-image-wrapper"},[
-                h("img",{src: cardImage, alt: c.title ? `Card: ${c.title}` : "Card", class:"card-cover"}),
+                h("img",{src: cardImages[c.id] || cardImage, "data-src": cardImage, alt: c.title ? `Card: ${c.title}` : "Card", class:"card-cover"}),
                 h("div",{class:"card-overlay"})
               ]),
               h("div",{class:"card-text"},[
@@ -976,7 +977,7 @@ const { app, h, toast, confettiBurst, installUmami, track } = window.EV_UI;
           console.warn("Skipping pack: missing id or packPath", it);
           continue;
         }
-        const pack = await window.EV_LOADER.loadPack(packPath);
+        const pack = it.pack || await window.EV_LOADER.loadPack(packPath);
         // Extract directory from packPath (e.g., "anti_love/pack.json" -> "anti_love")
         const packDir = packPath.split("/")[0];
         packs.push({ id, packPath, pack, packDir });
@@ -1012,5 +1013,25 @@ const { app, h, toast, confettiBurst, installUmami, track } = window.EV_UI;
     render(app());
   }
 
-  window.EV_APP = { boot };
+  // livereload hook: a pack directory's JSON changed on disk. Re-reads its
+  // pack.json and drops the cached data and card images; re-renders unless
+  // told the current view doesn't show that pack.
+  async function reloadPack(packDir, rerender = true){
+    const entries = S.packs.filter(p => p.packDir === packDir);
+    if(!entries.length) return false;
+    window.EV_LOADER.forgetPack(packDir);
+    for(const entry of entries){
+      delete S.dataCache[entry.id];
+      try{
+        entry.pack = await window.EV_LOADER.loadPack(entry.packPath);
+        S.packIndex[entry.id] = entry.pack;
+      } catch(e){
+        console.error(`Failed to reload pack ${entry.id}:`, e);
+      }
+    }
+    if(rerender) render(app());
+    return true;
+  }
+
+  window.EV_APP = { boot, reloadPack };
 })();
@@ -0,0 +1,62 @@
+// livereload.js: `serve.py --watch` injects this into pages. Applies each
+// change event from /__events with the smallest refresh that shows it.
+(function(){
+  if(!window.EventSource) return;
+  const RASTER = /\.(svg|png|jpe?g|gif|webp|avif)$/i;
+
+  function samePath(url, path){
+    try{ return new URL(url, location.href).pathname === path; }
+    catch(_e){ return false; }
+  }
+
+  // Images: re-point matching <img> elements at a fresh URL (the server
+  // ignores the query) so only the edited card or sticker is fetched again.
+  // Grid cards drawn from cards.svg.json keep their file path in data-src.
+  function refreshImages(paths, version){
+    document.querySelectorAll("img").forEach(img => {
+      const src = img.dataset.src || img.getAttribute("src") || "";
+      const path = paths.find(p => samePath(src, p));
+      if(path) img.src = src.split("?")[0] + "?v=" + version;
+    });
+  }
+
+  function refreshStyles(paths, version){
+    document.querySelectorAll('link[rel="stylesheet"]').forEach(link => {
+      const href = link.getAttribute("href") || "";
+      if(paths.some(p => samePath(href, p))) link.href = href.split("?")[0] + "?v=" + version;
+    });
+  }
+
+  // Pack JSON goes through EV_APP.reloadPack, which drops the app's cached
+  // copy and re-renders if the pack is on screen. JSON outside a pack (the
+  // manifests) feeds the whole app, so that takes a full reload.
+  function showsPack(pack){
+    if(!window.EV_ROUTER) return false;
+    const r = window.EV_ROUTER.parseHash();
+    if(r.path === "/boxes") return true;  // the gallery shows every pack
+    return !!pack && (r.parts.includes(pack) || r.params.get("pack") === pack);
+  }
+
+  function apply(change){
+    const paths = change.paths || [];
+    if(paths.some(p => /\.(html|js)$/i.test(p))){
+      location.reload();
+      return;
+    }
+    refreshImages(paths.filter(p => RASTER.test(p)), change.id);
+    refreshStyles(paths.filter(p => /\.css$/i.test(p)), change.id);
+    if(paths.some(p => /\.json$/i.test(p))){
+      if(!change.pack){
+        location.reload();
+      } else if(window.EV_APP && window.EV_APP.reloadPack){
+        window.EV_APP.reloadPack(change.pack, showsPack(change.pack));
+      }
+    }
+  }
+
+  const source = new EventSource("/__events");
+  source.addEventListener("change", e => {
+    try{ apply(JSON.parse(e.data)); }
+    catch(err){ console.warn("livereload:", err); }
+  });
+})();
@@ -14,13 +14,67 @@
     return true;
   }
 
-  async function loadManifest(){ return await j("packs/manifest.json"); }
+  // manifest.full.json embeds every pack.json (serve.py or
+  // tools/build_manifest_full.py); the plain manifest is the fallback.
+  async function loadManifest(){
+    try{ return await j("packs/manifest.full.json"); }
+    catch(_e){ return await j("packs/manifest.json"); }
+  }
   async function loadPack(packPath){
     if(!validatePackPath(packPath)) throw new Error("Invalid pack path");
     return await j(`packs/${packPath}`);
   }
 
+  // bundle.json (serve.py or tools/build_bundles.py) carries pack + data in one
+  // request; once it's missing we stop asking and use the per-file requests.
+  let bundlesAvailable = true;
+  async function loadPackBundle(packId){
+    if(!bundlesAvailable || !/^[a-zA-Z0-9_\-]+$/.test(packId)) return null;
+    try{
+      const b = await j(`packs/${packId}/bundle.json`);
+      return {
+        cards: { cards: b.cards || [] },
+        stickers: { stickers: b.stickers || [] },
+        tracks: { tracks: b.tracks || [] }
+      };
+    } catch(_e){
+      bundlesAvailable = false;
+      return null;
+    }
+  }
+
+  // cards.svg.json (serve.py or tools/build_card_batches.py) carries a pack's
+  // card SVGs in one response; each becomes an object URL the grid's <img>
+  // can use. Only ids not yet loaded are asked for (a static file returns
+  // them all). Without it, callers fall back to the per-card URLs.
+  let cardBatchesAvailable = true;
+  const cardImages = {};
+  async function loadCardImages(packId, ids){
+    const have = cardImages[packId] || (cardImages[packId] = {});
+    const missing = (ids || []).filter(id => id && !have[id]);
+    if(!missing.length || !cardBatchesAvailable || !/^[a-zA-Z0-9_\-]+$/.test(packId)) return have;
+    try{
+      const b = await j(`packs/${packId}/cards.svg.json?ids=${missing.map(encodeURIComponent).join(",")}`);
+      for(const [id, svg] of Object.entries(b.cards || {})){
+        if(!have[id]) have[id] = URL.createObjectURL(new Blob([svg], { type: "image/svg+xml" }));
+      }
+    } catch(_e){
+      cardBatchesAvailable = false;
+    }
+    return have;
+  }
+
+  // Drops what is memoized for one pack directory (livereload after a JSON
+  // edit), so the next loadCardImages asks the server again.
+  function forgetPack(packId){
+    for(const url of Object.values(cardImages[packId] || {})) URL.revokeObjectURL(url);
+    delete cardImages[packId];
+  }
+
   async function loadPackData(packId, pack){
+    const bundled = await loadPackBundle(packId);
+    if(bundled) return bundled;
+
     const base = `packs/${packId}/`;
     let cardsRaw = await j(base + pack.data.cards);
     let stickersRaw = await j(base + pack.data.stickers);
@@ -40,5 +94,5 @@
     return { cards, stickers, tracks };
   }
 
-  window.EV_LOADER = { loadManifest, loadPack, loadPackData };
+  window.EV_LOADER = { loadManifest, loadPack, loadPackData, loadCardImages, forgetPack };
 })();
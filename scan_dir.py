@@ -4,9 +4,13 @@ import csv
 import argparse
 from datetime import datetime
 import platform
+import re
 import socket
+import sys
 import getpass
 import hashlib
+import sqlite3
+import threading
 import concurrent.futures
 
 try:
@@ -14,11 +18,34 @@ try:
 except ImportError:
     tqdm = None
 
+# Directory names (compared case-insensitively) that are never entered.
 EXCLUDED_DIRS = {'node_modules', '.git', '__pycache__', 'venv', 'env', '$recycle.bin', 'system volume information'}
+# Per-directory ignore file, gitignore syntax, applying to that directory's subtree.
+IGNORE_FILE_NAME = ".scanignore"
 UI_FILES = {'index.html', 'style.css', 'tailwind.config.js'}
 LOGIC_FILES = {'main.js', 'preload.js', 'app.js'}
 CONFIG_FILES = {'package.json', 'vite.config.js', 'webpack.config.js'}
 ASSET_EXTS = {'.png', '.jpg', '.svg', '.md', '.txt', '.env'}
+DEFAULT_CACHE = "scan_cache.sqlite"
+# Streamed scans write new cache rows in transactions of this many.
+CACHE_FLUSH_ROWS = 1000
+# --output sqlite: one database that every scan adds to.
+DEFAULT_DB = "inventory.sqlite"
+# Records per executemany() / transaction when writing the database.
+DB_BATCH = 1000
+HASH_ALGORITHMS = ("md5", "blake2b", "sha256")
+# Duplicate candidates are first compared on this many bytes from each end.
+EDGE_BYTES = 64 * 1024
+# Files being processed at once in --stream mode; bounds memory, not speed.
+STREAM_INFLIGHT = 256
+# Every column a record can have, in output order; --stream writes all of
+# them up front since it can't look at the records first.
+KEY_ORDER = ['full_path', 'file_name', 'size_bytes', 'last_modified', 'is_duplicate', 'duplicate_of', 'app_name', 'description']
+STREAM_FIELDS = KEY_ORDER + sorted([
+    'created', 'dependencies', 'error', 'extension', 'file_hash', 'has_electron', 'has_tailwind',
+    'host', 'is_app_container', 'last_accessed', 'os', 'os_version', 'parent_folder', 'pkg_main',
+    'pkg_version', 'responsible_party', 'root_folder', 'scan_timestamp', 'scripts', 'subrole',
+    'username'])
 
 def detect_party(full_path):
     path = full_path.lower()
@@ -50,10 +77,10 @@ def detect_party(full_path):
     else:
         return "Unknown"
 
-def file_hash(path, block_size=65536):
-    """Calculates the MD5 hash of a file for speed."""
+def file_hash(path, block_size=65536, algorithm="md5"):
+    """Hex digest of the whole file with `algorithm` (MD5 by default, for speed)."""
     try:
-        hasher = hashlib.md5()
+        hasher = hashlib.new(algorithm)
         with open(path, "rb") as f:
             for block in iter(lambda: f.read(block_size), b""):
                 hasher.update(block)
@@ -61,6 +88,207 @@ def file_hash(path, block_size=65536):
     except Exception as e:
         return f"ERROR:{e}"
 
+def edge_hash(path, size, algorithm="md5"):
+    """Digest of the first and last EDGE_BYTES; cheap pre-check before a full hash."""
+    try:
+        hasher = hashlib.new(algorithm)
+        with open(path, "rb") as f:
+            hasher.update(f.read(EDGE_BYTES))
+            f.seek(max(size - EDGE_BYTES, 0))
+            hasher.update(f.read(EDGE_BYTES))
+        return hasher.hexdigest()
+    except Exception as e:
+        return f"ERROR:{e}"
+
+class ScanCache:
+    """Hashes from earlier scans, keyed on (path, size, mtime_ns, inode).
+
+    Each path can hold one digest per kind: an algorithm name for full
+    hashes, or "<algorithm>:edges" for edge_hash().
+
+    By default the whole table is loaded up front so worker threads only
+    read a dict, and new hashes are written back in one transaction by
+    save(). With preload=False (--stream) memory stays flat instead: each
+    lookup is a primary-key query and new rows go out every
+    CACHE_FLUSH_ROWS.
+    """
+    def __init__(self, db_path, rehash=False, preload=True):
+        self.db_path = os.path.abspath(db_path)
+        self.rehash = rehash
+        self.preload = preload
+        self.hits = 0
+        self.misses = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        # Worker threads share the connection; self.lock serialises its use.
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(file_hashes)")]
+        if columns and "kind" not in columns:
+            self.db.execute("DROP TABLE file_hashes")  # pre-kind cache, just rebuild it
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            " path TEXT, kind TEXT, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash TEXT,"
+            " PRIMARY KEY (path, kind))")
+        self.entries = {} if rehash or not preload else {
+            row[:2]: row[2:] for row in self.db.execute(
+                "SELECT path, kind, size, mtime_ns, inode, hash FROM file_hashes")}
+
+    def lookup(self, full_path, stat, kind):
+        key = (os.path.abspath(full_path), kind)
+        if self.preload or self.rehash:
+            entry = self.entries.get(key)
+        else:
+            with self.lock:
+                entry = self.db.execute(
+                    "SELECT size, mtime_ns, inode, hash FROM file_hashes WHERE path = ? AND kind = ?",
+                    key).fetchone()
+        hit = bool(entry) and entry[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[3] if hit else None
+
+    def store(self, full_path, stat, kind, digest):
+        if digest.startswith("ERROR"):
+            return
+        with self.lock:
+            self.pending.append((os.path.abspath(full_path), kind, stat.st_size,
+                                 stat.st_mtime_ns, stat.st_ino, digest))
+            if not self.preload and len(self.pending) >= CACHE_FLUSH_ROWS:
+                self.flush()
+
+    def flush(self):
+        """Write pending rows; callers hold self.lock (or are the only thread)."""
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                                self.pending)
+        self.pending = []
+
+    def save(self):
+        self.flush()
+        self.db.close()
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"{self.hits} reused, {self.misses} hashed ({rate:.1f}% hit rate)"
+
+def glob_to_regex(pattern):
+    """gitignore glob -> regex source: `*` and `?` stay within one path
+    segment, `**` spans segments, [...] classes pass through."""
+    out, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+            continue
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and "]" in pattern[i + 1:]:
+            end = pattern.index("]", i + 1)
+            body = pattern[i + 1:end]
+            out.append("[" + ("^" + body[1:] if body.startswith("!") else body) + "]")
+            i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+class IgnoreRules:
+    """Compiled gitignore-style patterns, matched against paths relative to `base`.
+
+    Supports `#` comments, `!` re-includes, a trailing `/` for directories
+    only, and anchoring: a pattern with a `/` other than a trailing one is
+    matched from `base`, anything else against every level below it. An
+    ignored directory is never entered, so nothing inside it can be
+    re-included (as in git).
+    """
+    def __init__(self, lines, base=""):
+        self.base = base  # scan-root-relative, "/"-separated; "" is the root
+        self.rules = []
+        for line in lines:
+            line = line.rstrip("\n").rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            line = line[1:] if negate else line
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            anchored = "/" in line
+            body = glob_to_regex(line.lstrip("/"))
+            regex = re.compile(("^" if anchored else "^(?:.*/)?") + body + "$")
+            self.rules.append((regex, negate, dir_only))
+
+    @classmethod
+    def load(cls, path, base=""):
+        with open(path, encoding="utf-8") as f:
+            return cls(f, base)
+
+    def match(self, rel, is_dir):
+        """True (ignore), False (re-included) or None (no rule applies); the last match wins."""
+        if self.base:
+            if not rel.startswith(self.base + "/"):
+                return None
+            rel = rel[len(self.base) + 1:]
+        verdict = None
+        for regex, negate, dir_only in self.rules:
+            if (is_dir or not dir_only) and regex.match(rel):
+                verdict = not negate
+        return verdict
+
+def is_ignored(rule_sets, rel, is_dir):
+    """Outer rule sets first, so a nested .scanignore overrides its parents."""
+    ignored = False
+    for rules in rule_sets:
+        verdict = rules.match(rel, is_dir)
+        if verdict is not None:
+            ignored = verdict
+    return ignored
+
+def walk_tree(top, rule_sets=(), rel=""):
+    """Yield (directory, [DirEntry of its files]) top-down, like os.walk.
+
+    Excluded and ignored directories are pruned before they are entered,
+    and the DirEntry objects are handed on so their stat() result is
+    reused rather than looked up again.
+    """
+    try:
+        with os.scandir(top) as it:
+            entries = list(it)
+    except OSError:
+        return
+    if any(e.name == IGNORE_FILE_NAME for e in entries):
+        try:
+            rule_sets = list(rule_sets) + [IgnoreRules.load(os.path.join(top, IGNORE_FILE_NAME), rel)]
+        except OSError:
+            pass
+    files, subdirs = [], []
+    for entry in entries:
+        entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            continue
+        if is_dir:
+            if entry.name.lower() in EXCLUDED_DIRS or is_ignored(rule_sets, entry_rel, True):
+                continue
+            if not entry.is_symlink():  # os.walk doesn't follow links either
+                subdirs.append((entry.path, entry_rel))
+        elif not is_ignored(rule_sets, entry_rel, False):
+            files.append(entry)
+    yield top, files
+    for path, sub_rel in subdirs:
+        yield from walk_tree(path, rule_sets, sub_rel)
+
 def parse_package_json(file_path):
     try:
         with open(file_path, encoding="utf-8") as f:
@@ -103,10 +331,11 @@ def classify_file(file, parent_dir):
     return "general"
 
 def process_file(args):
-    root, file, path, root_metadata = args
+    root, entry, path, root_metadata = args
+    file = entry.name
     full_path = os.path.join(root, file)
     try:
-        stat = os.stat(full_path)
+        stat = entry.stat()
         metadata = {
             "file_name": file,
             "full_path": full_path,
@@ -124,7 +353,7 @@ def process_file(args):
             "parent_folder": os.path.basename(root),
             "root_folder": os.path.basename(path),
             "responsible_party": detect_party(full_path),
-            "file_hash": file_hash(full_path)
+            "file_hash": ""
         }
         # Merge the app container metadata
         metadata.update(root_metadata)
@@ -136,36 +365,56 @@ def process_file(args):
             "error": str(e)
         }
 
-def scan_directory(path, quiet=False):
-    tasks = []
-    for root, dirs, files in os.walk(path):
-        # More robust exclusion
-        root_lower = root.lower()
-        if any(excl in root_lower for excl in EXCLUDED_DIRS):
-            dirs[:] = [] # Don't recurse into excluded directories
-            continue
+def hash_file(full_path, algorithm, cache=None, edges=False):
+    """file_hash() or edge_hash() of a file, reusing the cache when it still matches."""
+    kind = f"{algorithm}:edges" if edges else algorithm
+    try:
+        stat = os.stat(full_path)
+    except OSError as e:
+        return f"ERROR:{e}"
+    digest = cache.lookup(full_path, stat, kind) if cache else None
+    if digest is None:
+        if edges:
+            digest = edge_hash(full_path, stat.st_size, algorithm)
+        else:
+            digest = file_hash(full_path, algorithm=algorithm)
+        if cache:
+            cache.store(full_path, stat, kind, digest)
+    return digest
 
-        root_metadata = {}
-        is_app_container = 'package.json' in files and ('index.html' in files or 'main.js' in files)
-        root_metadata["is_app_container"] = is_app_container
-        if is_app_container:
-            pkg_path = os.path.join(root, 'package.json')
-            pkg_data = parse_package_json(pkg_path)
-            root_metadata.update(pkg_data)
+def same_key_groups(entries, key):
+    """Lists of entries sharing key(entry), skipping singletons and ERROR keys."""
+    groups = {}
+    for entry in entries:
+        k = key(entry)
+        if not (isinstance(k, str) and k.startswith("ERROR")):
+            groups.setdefault(k, []).append(entry)
+    return [g for g in groups.values() if len(g) > 1]
 
-        for file in files:
-            tasks.append((root, file, path, root_metadata))
+def find_duplicates(inventory, algorithm="md5", cache=None):
+    """Fill file_hash / is_duplicate / duplicate_of, hashing as little as possible.
 
-    inventory = []
+    Only files sharing a size can be duplicates. Those larger than two edges
+    are compared on edge_hash() first, and only files still tied get a full
+    hash; file_hash stays "" for everything ruled out earlier. Returns
+    (edge-hashed, fully hashed) counts.
+    """
+    records = [e for e in inventory if "error" not in e]
+    for entry in inventory:
+        entry.setdefault("file_hash", "")
+
+    candidates = [e for g in same_key_groups(records, lambda e: e["size_bytes"]) for e in g]
+    large = [e for e in candidates if e["size_bytes"] > 2 * EDGE_BYTES]
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        if not quiet and tqdm:
-            results = tqdm(executor.map(process_file, tasks), total=len(tasks), desc="Processing files", unit="file")
-        else:
-            results = executor.map(process_file, tasks)
-        
-        inventory = [r for r in results if r]
+        edges = dict(zip((e["full_path"] for e in large), executor.map(
+            lambda e: hash_file(e["full_path"], algorithm, cache, edges=True), large)))
+        tied = [e for g in same_key_groups(large, lambda e: (e["size_bytes"], edges[e["full_path"]]))
+                for e in g]
+        full = [e for e in candidates if e["size_bytes"] <= 2 * EDGE_BYTES] + tied
+        for entry, digest in zip(full, executor.map(
+                lambda e: hash_file(e["full_path"], algorithm, cache), full)):
+            entry["file_hash"] = digest
 
-    # Deduplication
     hash_map = {}
     for entry in inventory:
         h = entry.get("file_hash", "")
@@ -180,24 +429,465 @@ def scan_directory(path, quiet=False):
             entry["is_duplicate"] = False
             entry["duplicate_of"] = ""
             hash_map[h] = entry["full_path"]
+    return len(large), len(full)
 
+class DuplicateIndex:
+    """Duplicate resolution for records that arrive one at a time (--stream).
+
+    Same staging as find_duplicates(), done incrementally: a file is hashed
+    only once another file of its size (and, past two edges, its edge hash)
+    has turned up, and the first file seen with some content is the
+    original. Records themselves are never kept, but memory is not
+    constant: `sizes` holds a path for every distinct file size seen, and
+    `edges` / `first` a path for every file that needed hashing, so it grows
+    with O(distinct sizes + hashed files) rather than with the tree.
+
+    resolve() is called from the worker threads, so hashing stays parallel.
+    Only same-size files can be duplicates, so each size that has collided
+    gets its own lock, and files of one size are resolved one at a time.
+    """
+    def __init__(self, algorithm="md5", cache=None):
+        self.algorithm = algorithm
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.sizes = {}   # size -> first path, None once a second file of that size arrived
+        self.groups = {}  # size -> [lock, first path still to be keyed] once sizes collide
+        self.edges = {}   # (size, edge digest) -> first path, None once fully hashed
+        self.first = {}   # full digest -> first path
+        self.edge_hashed = self.fully_hashed = 0
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def full(self, path):
+        self.count("fully_hashed")
+        return hash_file(path, self.algorithm, self.cache)
+
+    def key(self, path, size):
+        """Register `path` past the size stage; returns its full digest, or
+        "" while no other file shares its edge hash. Callers hold the
+        size's group lock."""
+        if size <= 2 * EDGE_BYTES:
+            digest = self.full(path)
+            if not digest.startswith("ERROR"):
+                self.first.setdefault(digest, path)
+            return digest
+        self.count("edge_hashed")
+        edge = hash_file(path, self.algorithm, self.cache, edges=True)
+        if edge.startswith("ERROR"):
+            return edge
+        earlier = self.edges.setdefault((size, edge), path)
+        if earlier == path:
+            return ""
+        if earlier is not None:
+            self.edges[(size, edge)] = None
+            digest = self.full(earlier)
+            if not digest.startswith("ERROR"):
+                self.first.setdefault(digest, earlier)
+        digest = self.full(path)
+        if not digest.startswith("ERROR"):
+            self.first.setdefault(digest, path)
+        return digest
+
+    def resolve(self, entry):
+        """Fill file_hash / is_duplicate / duplicate_of on one record."""
+        entry.update(file_hash="", is_duplicate=False, duplicate_of="")
+        if "error" in entry:
+            return entry
+        path, size = entry["full_path"], entry["size_bytes"]
+        with self.lock:
+            earlier = self.sizes.setdefault(size, path)
+            if earlier == path:
+                return entry
+            if earlier is not None:
+                self.sizes[size] = None
+                self.groups[size] = [threading.Lock(), earlier]
+            group = self.groups[size]
+        with group[0]:
+            if group[1] is not None:
+                self.key(group[1], size)
+                group[1] = None
+            digest = entry["file_hash"] = self.key(path, size)
+            original = self.first.get(digest) if digest else None
+        if original and original != path:
+            entry["is_duplicate"] = True
+            entry["duplicate_of"] = original
+        return entry
+
+def iter_tasks(path, rules=None, skip=()):
+    """process_file() arguments for every file under `path`, as the walk finds them.
+
+    `skip` holds absolute paths of files this run writes itself (hash cache,
+    output, database); they and their -journal/-wal companions are left out.
+    """
+    for root, entries in walk_tree(path, [rules] if rules else []):
+        files = {entry.name for entry in entries}
+        root_metadata = {}
+        is_app_container = 'package.json' in files and ('index.html' in files or 'main.js' in files)
+        root_metadata["is_app_container"] = is_app_container
+        if is_app_container:
+            pkg_path = os.path.join(root, 'package.json')
+            pkg_data = parse_package_json(pkg_path)
+            root_metadata.update(pkg_data)
+
+        for entry in entries:
+            if skip and os.path.abspath(entry.path).startswith(skip):
+                continue
+            yield root, entry, path, root_metadata
+
+def bounded_map(fn, items, limit=STREAM_INFLIGHT):
+    """executor.map() that pulls `items` lazily and keeps at most `limit`
+    calls in flight; results come back in completion order."""
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(fn, item))
+            if len(pending) >= limit:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+class RowWriter:
+    """Writes records to CSV (fixed STREAM_FIELDS or given columns) or JSON Lines."""
+    def __init__(self, f, fmt="csv", fields=STREAM_FIELDS):
+        self.f = f
+        self.fmt = fmt
+        if fmt == "csv":
+            self.csv = csv.DictWriter(f, fieldnames=fields)
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.fmt == "csv":
+            self.csv.writerow(record)
+        else:
+            self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+INVENTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    root TEXT NOT NULL,
+    started TEXT NOT NULL,
+    finished TEXT,
+    host TEXT, username TEXT, os TEXT, os_version TEXT,
+    hash_algorithm TEXT,
+    file_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    id INTEGER PRIMARY KEY,
+    algorithm TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    UNIQUE (algorithm, digest)
+);
+CREATE TABLE IF NOT EXISTS app_containers (
+    id INTEGER PRIMARY KEY,
+    scan_id INTEGER NOT NULL REFERENCES scans(id),
+    path TEXT NOT NULL,
+    app_name TEXT, description TEXT, dependencies TEXT, scripts TEXT,
+    has_electron INTEGER, has_tailwind INTEGER, pkg_main TEXT, pkg_version TEXT,
+    UNIQUE (scan_id, path)
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    scan_id INTEGER NOT NULL REFERENCES scans(id),
+    full_path TEXT NOT NULL,
+    file_name TEXT, extension TEXT, size_bytes INTEGER,
+    last_modified TEXT, last_accessed TEXT, created TEXT, scan_timestamp TEXT,
+    subrole TEXT, parent_folder TEXT, root_folder TEXT, responsible_party TEXT,
+    hash_id INTEGER REFERENCES hashes(id),
+    is_duplicate INTEGER, duplicate_of TEXT,
+    container_id INTEGER REFERENCES app_containers(id),
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_scan ON files(scan_id);
+CREATE INDEX IF NOT EXISTS files_hash ON files(hash_id);
+CREATE INDEX IF NOT EXISTS files_extension ON files(extension);
+CREATE INDEX IF NOT EXISTS files_party ON files(responsible_party);
+CREATE INDEX IF NOT EXISTS files_size ON files(size_bytes);
+"""
+
+FILE_COLUMNS = ['full_path', 'file_name', 'extension', 'size_bytes', 'last_modified', 'last_accessed',
+                'created', 'scan_timestamp', 'subrole', 'parent_folder', 'root_folder',
+                'responsible_party', 'is_duplicate', 'duplicate_of', 'error']
+
+class SqliteWriter:
+    """RowWriter counterpart for --output sqlite.
+
+    Each run becomes a row in `scans`; host and OS details live there,
+    package.json details in `app_containers` (one per container directory)
+    and digests in `hashes`, so `files` only holds references. Records are
+    buffered and inserted DB_BATCH at a time, each batch in one transaction.
+    """
+    def __init__(self, db_path, root, algorithm="md5"):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(INVENTORY_SCHEMA)
+        self.algorithm = algorithm
+        self.pending = []
+        self.containers = {}  # directory -> app_containers.id for this scan
+        self.count = 0
+        with self.db:
+            self.scan_id = self.db.execute(
+                "INSERT INTO scans (root, started, host, username, os, os_version, hash_algorithm)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(root), datetime.now().isoformat(), socket.gethostname(),
+                 getpass.getuser(), platform.system(), platform.version(), algorithm)).lastrowid
+
+    def container_id(self, record):
+        if not record.get("is_app_container"):
+            return None
+        directory = os.path.dirname(os.path.abspath(record["full_path"]))
+        if directory not in self.containers:
+            self.db.execute(
+                "INSERT OR IGNORE INTO app_containers (scan_id, path, app_name, description,"
+                " dependencies, scripts, has_electron, has_tailwind, pkg_main, pkg_version)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.scan_id, directory, record.get("app_name"), record.get("description"),
+                 json.dumps(record.get("dependencies", [])), json.dumps(record.get("scripts", [])),
+                 int(bool(record.get("has_electron"))), int(bool(record.get("has_tailwind"))),
+                 record.get("pkg_main"), record.get("pkg_version")))
+            self.containers[directory] = self.db.execute(
+                "SELECT id FROM app_containers WHERE scan_id = ? AND path = ?",
+                (self.scan_id, directory)).fetchone()[0]
+        return self.containers[directory]
+
+    def write(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= DB_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            digests = [(self.algorithm, r["file_hash"]) for r in self.pending
+                       if r.get("file_hash") and not r["file_hash"].startswith("ERROR")]
+            self.db.executemany("INSERT OR IGNORE INTO hashes (algorithm, digest) VALUES (?, ?)", digests)
+            rows = []
+            for r in self.pending:
+                digest = r.get("file_hash") or ""
+                values = [r.get(k) for k in FILE_COLUMNS]
+                values[FILE_COLUMNS.index("full_path")] = os.path.abspath(r["full_path"])
+                if r.get("duplicate_of"):
+                    values[FILE_COLUMNS.index("duplicate_of")] = os.path.abspath(r["duplicate_of"])
+                values[FILE_COLUMNS.index("is_duplicate")] = int(bool(r.get("is_duplicate")))
+                rows.append([self.scan_id] + values + [
+                    self.algorithm, None if digest.startswith("ERROR") else digest,
+                    self.container_id(r)])
+            self.db.executemany(
+                f"INSERT INTO files (scan_id, {', '.join(FILE_COLUMNS)}, hash_id, container_id)"
+                f" VALUES (?, {', '.join('?' * len(FILE_COLUMNS))},"
+                " (SELECT id FROM hashes WHERE algorithm = ? AND digest = ?), ?)", rows)
+        self.count += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        with self.db:
+            self.db.execute("UPDATE scans SET finished = ?, file_count = ? WHERE id = ?",
+                            (datetime.now().isoformat(), self.count, self.scan_id))
+        self.db.close()
+
+# Saved reports for --report, each (description, SQL, default --param values).
+# :scan defaults to the latest scan in the database.
+LATEST_SCAN = "COALESCE(CAST(:scan AS INTEGER), (SELECT MAX(id) FROM scans))"
+REPORTS = {
+    "duplicates": (
+        "Duplicate files, filtered by extension, minimum size and responsible party",
+        f"""SELECT f.full_path, f.size_bytes, f.responsible_party, f.duplicate_of, h.digest
+            FROM files f JOIN hashes h ON h.id = f.hash_id
+            WHERE f.scan_id = {LATEST_SCAN} AND f.is_duplicate = 1
+              AND f.extension LIKE :ext AND f.size_bytes >= CAST(:min_bytes AS INTEGER)
+              AND f.responsible_party LIKE :party
+            ORDER BY f.size_bytes DESC""",
+        {"scan": None, "ext": "%", "min_bytes": 0, "party": "%"}),
+    "wasted": (
+        "Bytes taken by duplicate copies, per extension",
+        f"""SELECT extension, COUNT(*) AS copies, SUM(size_bytes) AS wasted_bytes
+            FROM files WHERE scan_id = {LATEST_SCAN} AND is_duplicate = 1
+            GROUP BY extension ORDER BY wasted_bytes DESC""",
+        {"scan": None}),
+    "parties": (
+        "File count and bytes per responsible party",
+        f"""SELECT responsible_party, COUNT(*) AS files, SUM(size_bytes) AS bytes
+            FROM files WHERE scan_id = {LATEST_SCAN}
+            GROUP BY responsible_party ORDER BY bytes DESC""",
+        {"scan": None}),
+    "largest": (
+        "Largest files",
+        f"""SELECT full_path, size_bytes, extension, responsible_party
+            FROM files WHERE scan_id = {LATEST_SCAN}
+            ORDER BY size_bytes DESC LIMIT CAST(:limit AS INTEGER)""",
+        {"scan": None, "limit": 25}),
+    "apps": (
+        "App containers found (package.json next to index.html or main.js)",
+        f"""SELECT c.path, c.app_name, c.pkg_version, c.has_electron, c.has_tailwind,
+                   COUNT(f.id) AS files
+            FROM app_containers c LEFT JOIN files f ON f.container_id = c.id
+            WHERE c.scan_id = {LATEST_SCAN} GROUP BY c.id ORDER BY c.path""",
+        {"scan": None}),
+    "changed": (
+        "Files modified since the previous scan of the same root",
+        """SELECT cur.full_path, old.size_bytes AS old_size, cur.size_bytes AS new_size,
+                  old.last_modified AS old_modified, cur.last_modified AS new_modified
+           FROM files cur JOIN files old ON old.full_path = cur.full_path
+                JOIN scans sc ON sc.id = cur.scan_id JOIN scans so ON so.id = old.scan_id
+           WHERE cur.scan_id = (SELECT MAX(id) FROM scans)
+             AND old.scan_id = (SELECT MAX(p.id) FROM scans p JOIN scans l ON p.root = l.root
+                                WHERE l.id = (SELECT MAX(id) FROM scans) AND p.id < l.id)
+             AND (cur.size_bytes != old.size_bytes OR cur.last_modified != old.last_modified
+                  -- digests of different --hash algorithms never match
+                  OR (cur.hash_id != old.hash_id AND sc.hash_algorithm = so.hash_algorithm))
+           ORDER BY cur.full_path""",
+        {}),
+    "scans": (
+        "Scans stored in the database",
+        "SELECT id, root, started, finished, host, hash_algorithm, file_count FROM scans ORDER BY id",
+        {}),
+}
+
+def run_report(db_path, name, params, out):
+    """Run a saved report against an --output sqlite database, writing CSV to `out`."""
+    _, sql, defaults = REPORTS[name]
+    values = dict(defaults)
+    values.update(params)
+    db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        cursor = db.execute(sql, values)
+        writer = csv.writer(out)
+        writer.writerow([column[0] for column in cursor.description])
+        count = 0
+        for row in cursor:
+            writer.writerow(row)
+            count += 1
+    finally:
+        db.close()
+    return count
+
+def stream_directory(path, writer, quiet=False, cache=None, algorithm="md5", rules=None, skip=()):
+    """Scan `path` handing each record to `writer` as soon as it is resolved.
+
+    Nothing is kept per record, so memory stays flat however large the
+    tree is; duplicates point at the first copy *resolved*, and file order
+    follows completion rather than the walk. Records are resolved (and
+    hashed) in the worker threads. Returns (records, DuplicateIndex).
+    """
+    dupes = DuplicateIndex(algorithm, cache)
+    results = bounded_map(lambda task: dupes.resolve(process_file(task)),
+                          iter_tasks(path, rules, skip))
+    if not quiet and tqdm:
+        results = tqdm(results, desc="Processing files", unit="file")
+    count = 0
+    for record in results:
+        writer.write(record)
+        count += 1
+    return count, dupes
+
+def scan_directory(path, quiet=False, cache=None, algorithm="md5", rules=None, skip=()):
+    tasks = list(iter_tasks(path, rules, skip))
+    inventory = []
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        if not quiet and tqdm:
+            results = tqdm(executor.map(process_file, tasks), total=len(tasks), desc="Processing files", unit="file")
+        else:
+            results = executor.map(process_file, tasks)
+        
+        inventory = [r for r in results if r]
+
+    edge_hashed, fully_hashed = find_duplicates(inventory, algorithm, cache)
+    if not quiet:
+        print(f"[i] Duplicate check: {edge_hashed} edge-hashed, "
+              f"{fully_hashed} of {len(inventory)} files hashed in full ({algorithm})")
     return inventory
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="📁 Enhanced Full-Feature App Scanner")
     parser.add_argument("--path", default=".", help="Directory path to scan")
     parser.add_argument("--quiet", action="store_true", help="Suppress progress output")
+    parser.add_argument("--cache", default=DEFAULT_CACHE,
+                        help="SQLite file of hashes reused across scans ('' to disable)")
+    parser.add_argument("--rehash", action="store_true",
+                        help="Ignore cached hashes and hash every file again")
+    parser.add_argument("--hash", choices=HASH_ALGORITHMS, default="md5",
+                        help="Hash algorithm for duplicate detection")
+    parser.add_argument("--format", "--output", dest="format", choices=["csv", "jsonl", "sqlite"],
+                        default="csv", help="Output format; sqlite adds the scan to --db")
+    parser.add_argument("--db", default=DEFAULT_DB,
+                        help="SQLite inventory that --output sqlite appends to and --report reads")
+    parser.add_argument("--report", choices=sorted(REPORTS),
+                        help="Run a saved report over --db instead of scanning: "
+                             + "; ".join(f"{k}: {v[0]}" for k, v in sorted(REPORTS.items())))
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="Report parameter, e.g. --param ext=.mp3 --param min_bytes=3000000")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write rows as files are processed (fixed columns; memory grows with the "
+                             "number of distinct file sizes, not files; duplicates point at the first "
+                             "copy hashed, not the first in walk order)")
+    parser.add_argument("--ignore-file", default="",
+                        help=f"gitignore-style rules anchored at --path (plus any {IGNORE_FILE_NAME} in the tree)")
     args = parser.parse_args()
 
-    inventory = scan_directory(args.path, quiet=args.quiet)
+    if args.report:
+        if not os.path.exists(args.db):
+            parser.error(f"no inventory database at {args.db}")
+        defaults = REPORTS[args.report][2]
+        params = {}
+        for param in args.param:
+            name, sep, value = param.partition("=")
+            if not sep:
+                parser.error(f"--param {param!r}: expected NAME=VALUE")
+            if name not in defaults:
+                known = ", ".join(sorted(defaults)) or "none"
+                parser.error(f"--param {name!r}: not a parameter of report {args.report!r} "
+                             f"(takes: {known})")
+            params[name] = value
+        rows = run_report(args.db, args.report, params, sys.stdout)
+        print(f"[i] {args.report}: {rows} rows", file=sys.stderr)
+        raise SystemExit(0)
+
+    rules = IgnoreRules.load(args.ignore_file) if args.ignore_file else None
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     # Handle case where path is '.'
     abs_path = os.path.abspath(args.path)
     folder_name = os.path.basename(abs_path)
-    out_file = f"{folder_name}_inventory_{timestamp}.csv"
+    out_file = args.db if args.format == "sqlite" else f"{folder_name}_inventory_{timestamp}.{args.format}"
+
+    cache = ScanCache(args.cache, rehash=args.rehash, preload=not args.stream) if args.cache else None
+    # Files this run writes, which may well sit inside --path.
+    skip = tuple(os.path.abspath(p) for p in [out_file] + ([args.cache] if cache else []))
+    if args.stream:
+        if args.format == "sqlite":
+            writer = SqliteWriter(args.db, args.path, args.hash)
+            count, dupes = stream_directory(args.path, writer, quiet=args.quiet,
+                                            cache=cache, algorithm=args.hash, rules=rules, skip=skip)
+            writer.close()
+        else:
+            with open(out_file, "w", newline="", encoding="utf-8") as f:
+                count, dupes = stream_directory(args.path, RowWriter(f, args.format), quiet=args.quiet,
+                                                cache=cache, algorithm=args.hash, rules=rules, skip=skip)
+        if not args.quiet:
+            print(f"[i] Duplicate check: {dupes.edge_hashed} edge-hashed, "
+                  f"{dupes.fully_hashed} of {count} files hashed in full ({args.hash})")
+    else:
+        inventory = scan_directory(args.path, quiet=args.quiet, cache=cache, algorithm=args.hash,
+                                   rules=rules, skip=skip)
+    if cache:
+        cache.save()
+        if not args.quiet:
+            print(f"[i] Hash cache: {cache.summary()}")
 
-    if inventory:
+    if args.stream:
+        print(f"[✓] Inventory streamed to: {out_file} ({count} rows)")
+    elif inventory and args.format == "sqlite":
+        writer = SqliteWriter(args.db, args.path, args.hash)
+        for item in inventory:
+            writer.write(item)
+        writer.close()
+        print(f"[✓] Inventory added to: {out_file} (scan {writer.scan_id}, {writer.count} files)")
+    elif inventory:
         # Dynamically get all keys from all records
         all_keys = set()
         for item in inventory:
@@ -205,13 +895,12 @@ if __name__ == "__main__":
         
         # Sort keys for consistent column order
         # Put important keys first
-        key_order = ['full_path', 'file_name', 'size_bytes', 'last_modified', 'is_duplicate', 'duplicate_of', 'app_name', 'description']
-        sorted_keys = key_order + sorted([k for k in all_keys if k not in key_order])
+        sorted_keys = KEY_ORDER + sorted([k for k in all_keys if k not in KEY_ORDER])
 
         with open(out_file, "w", newline="", encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=sorted_keys)
-            writer.writeheader()
-            writer.writerows(inventory)
+            writer = RowWriter(f, args.format, sorted_keys)
+            for item in inventory:
+                writer.write(item)
         print(f"[✓] Inventory saved to: {out_file}")
     else:
         print("[X] No inventory data found.")
\ No newline at end of file
@@ -2,26 +2,2206 @@
 """serve.py - local dev server for the standalone EchoValentines Canvas 5-page site
 
 Usage:
-  python3 serve.py
+  python3 serve.py               # dev: no-store on everything
+  python3 serve.py --mode=prod   # content-hash ETags + per-path Cache-Control
 Then open:
   http://localhost:8092/index.html
+
+Every static file is byte-served: `Range` requests (single or multi-range)
+get `206 Partial Content`, guarded by `If-Range`, so seeking inside a pack
+track only fetches the bytes the <audio> element asks for.
+
+Text assets (SVG, JSON, JS, CSS, HTML) are sent compressed when the client
+accepts it: a fresh `.br`/`.gz` sidecar written by tools/build_sidecars.py is
+preferred, otherwise the file is compressed on the fly into a bounded cache.
+
+`packs/<id>/bundle.json` is generated on request: pack.json plus its cards,
+stickers and tracks lists in one response (tools/build_bundles.py writes the
+same file for static/CDN hosting). `packs/manifest.full.json` is the manifest
+with each pack.json and its gallery summary embedded, so the first gallery
+paint needs one request (tools/build_manifest_full.py for static hosting).
+`packs/<id>/cards.svg.json` carries the pack's card SVGs as one JSON map, so
+a pack grid renders after a single round trip; `?ids=a,b` asks for just the
+cards the client is missing (tools/build_card_batches.py writes the full set).
+
+`--engine asyncio` swaps ThreadingHTTPServer for an asyncio loop speaking
+HTTP/1.1 with keep-alive and pipelining; idle connections cost a coroutine
+rather than a thread, and the same handler classes produce every response.
+
+The threads engine hands connections to a fixed pool (`--pool`) through a
+bounded queue; when it is full new connections get an immediate `503` with
+`Retry-After`. Audio waits in its own lane and a few workers (`--reserved`)
+never take it, so JSON and card art stay quick while MP3s fill the pool.
+
+`--workers N` preforks N worker processes that each bind the port with
+SO_REUSEPORT, so the kernel spreads connections across cores. The parent
+builds the file index once before forking, restarts workers that die, and
+on SIGHUP starts a fresh generation before letting the old one finish its
+in-flight requests (audio streams included) and exit. Only the parent polls
+the index; when a poll finds changes it rolls the workers the same way, so
+they never drift apart or each stat the tree. `--watch` is the exception:
+live reload needs the change events in the process holding the connection,
+so there each worker polls its own copy.
+
+`/__metrics` exposes Prometheus text-format counters (per process, so with
+--workers each scrape sees one worker) and every file response carries a
+`Server-Timing` header with its lookup and read phases.
+
+tools/build_archive.py packs the pack tree into one file (or one per pack)
+with an offset/length/hash index; `--archive` mmaps it and serves members,
+Range requests and their precompressed variants straight from the mapping,
+ahead of any file at the same path.
+
+Raster images with variants from tools/build_image_variants.py are sent as
+AVIF or WebP to browsers whose `Accept` names that type (`Vary: Accept`);
+everyone else gets the original, and pack JSON keeps the original paths.
+
+bundle.json and index.html responses carry `Link: rel=preload` headers for
+the art the page needs first (pack cover, first card, SVG seal stickers, or
+the gallery covers); with `--early-hints` the asyncio engine also sends them
+ahead of the response as `103 Early Hints`.
+
+`--access-log` appends one JSON line per request; tools/analyze_access_log.py
+turns those logs into per-pack next-request probabilities, and `--prefetch`
+uses them to add `Link: rel=prefetch` for the likeliest next files that fit
+in `--prefetch-kb`.
+
+`--watch` replaces dev's blanket no-store: responses keep their validators
+(`no-cache`, so edits are seen on revalidation), the file index is polled
+every `--poll` seconds, and pages get assets/js/livereload.js, which hears
+changes over Server-Sent Events on `/__events` and refreshes only the
+changed card or sticker images. A pack JSON edit drops the app's cached copy
+of that pack (EV_APP.reloadPack) and re-renders it; a manifest edit reloads
+the page.
+
+Misses get a short precomputed `404` rather than send_error's HTML page, and
+with a file index the missing path is remembered until the next poll sees a
+change, so repeated probes for optional files (tracks.json, guessed seal
+stickers) skip the lookup. `/__metrics` counts requests and 404s per pack.
+
+tools/build_fingerprints.py writes a copy of the site (`--root dist`) where
+pack assets carry content-hashed names like `ac-01.3f9a1c2e.svg`; in prod
+those are sent `Cache-Control: immutable, max-age=31536000`.
 """
 
+from http import HTTPStatus
 from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import argparse, asyncio, datetime, email.utils, fnmatch, functools, gzip, hashlib, io, json, mmap, queue, re, selectors, shutil, signal, socket, struct, threading, time, urllib.parse, uuid
 import webbrowser, os
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 PORT = int(os.environ.get("PORT","8092"))
 
-class NoCache(SimpleHTTPRequestHandler):
+# More ranges than this in one request is almost certainly abuse; serve 200.
+MAX_RANGES = 16
+# Bodies at least this large go out through the kernel (os.sendfile) rather
+# than being read into Python; below it the extra syscalls don't pay off.
+SENDFILE_THRESHOLD = 64 * 1024
+
+RASTER_EXTS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+# Pre-generated raster variants (tools/build_image_variants.py), stored next to
+# the original as name.png.webp / name.webp.avif; server preference order.
+IMAGE_VARIANTS = [("image/avif", ".avif"), ("image/webp", ".webp")]
+COMPRESSIBLE_EXTS = {".svg", ".json", ".js", ".css", ".html"}
+# Below this the headers outweigh the savings.
+MIN_COMPRESS_SIZE = 256
+# Content-Coding -> sidecar suffix, in server preference order.
+SIDECARS = [("br", ".br"), ("gzip", ".gz")]
+# Memory budget for bodies compressed on the fly when no sidecar exists.
+COMPRESS_CACHE_BYTES = int(os.environ.get("COMPRESS_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Hot-file byte cache (prod); --cache-mb overrides. Bigger files stream from disk.
+HOT_CACHE_BYTES = 64 * 1024 * 1024
+HOT_FILE_MAX = 512 * 1024
+# Request paths remembered as missing until the index next changes; the set
+# is dropped wholesale when it grows past this.
+MISSING_MAX = 4096
+# Precomputed 404 body: probes for optional files shouldn't render a page.
+NOT_FOUND_BODY = b"404 Not Found\n"
+
+def parse_range(header, size):
+    """Parse a `Range` header into sorted, merged (start, end) inclusive pairs.
+
+    Returns None when the header should be ignored (absent, not `bytes`,
+    malformed, too many parts) and [] when nothing is satisfiable (416).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+    ranges = []
+    for part in parts:
+        first, sep, last = part.strip().partition("-")
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last) or not (first + last).isdigit():
+            return None
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = int(last) if last else size - 1
+            ranges.append((start, min(end, size - 1)))
+        elif int(last) > 0:
+            ranges.append((max(size - int(last), 0), size - 1))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+# Prod-mode Cache-Control, first matching glob (relative to the web root) wins.
+# Manifests and pack JSON change when packs are edited, so they revalidate
+# quickly; card art, stickers and audio are only replaced, never edited live.
+CACHE_POLICIES = [
+    ("*.html", "no-cache"),
+    ("packs/manifest*.json", "public, max-age=60"),
+    ("packs/*.json", "public, max-age=300"),
+    ("assets/js/*", "public, max-age=3600"),
+    ("assets/css/*", "public, max-age=3600"),
+    ("packs/*", "public, max-age=604800"),
+    ("*", "public, max-age=86400"),
+]
+
+# name.<8 hex>.ext, written by tools/build_fingerprints.py: the name changes
+# whenever the bytes do, so these may be cached for a year without revalidating.
+FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{8}\.[A-Za-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+def copy_range(source, outputfile, offset, length, bufsize=64 * 1024):
+    source.seek(offset)
+    while length > 0:
+        chunk = source.read(min(length, bufsize))
+        if not chunk:
+            break
+        outputfile.write(chunk)
+        length -= len(chunk)
+
+# Pack archive (tools/build_archive.py): header, member bytes, then a JSON
+# index mapping web-root paths to {"span": [offset, length], "hash", "mtime"}
+# plus optional "br"/"gzip" spans for precompressed variants.
+ARCHIVE_MAGIC = b"EVPACK01"
+ARCHIVE_HEADER = struct.Struct("<8sQQ")  # magic, index offset, index length
+
+class PackArchive:
+    """Read-only mmap of a pack archive; members are served as slices of it."""
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, offset, length = ARCHIVE_HEADER.unpack_from(self.map)
+            if magic != ARCHIVE_MAGIC or offset + length > len(self.map):
+                raise ValueError(f"{path} is not a pack archive")
+            self.entries = json.loads(self.map[offset:offset + length])["files"]
+        except:
+            self.file.close()
+            raise
+        self.view = memoryview(self.map)
+        for entry in self.entries.values():
+            entry["archive"] = self
+
+    def open(self, span):
+        return ArchiveMember(self, *span)
+
+class ArchiveMember(io.RawIOBase):
+    """File object over one span of a PackArchive.
+
+    read() hands out memoryview slices of the mapping, so bodies reach the
+    socket without a user-space copy; sendfile_args() points sendfile at the
+    archive itself.
+    """
+    def __init__(self, archive, base, length):
+        super().__init__()
+        self.archive, self.base, self.length, self.pos = archive, base, length, 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.pos = max(0, min(pos, self.length))
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.length if size is None or size < 0 else min(self.pos + size, self.length)
+        chunk = self.archive.view[self.base + self.pos:self.base + end]
+        self.pos = end
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+def sendfile_args(f, offset):
+    """(file, offset) to hand sendfile for `offset` into body file `f`."""
+    if isinstance(f, ArchiveMember):
+        return f.archive.file, f.base + offset
+    return f, offset
+
+def file_etag(fs):
+    """Cheap validator from mtime and size, good enough for If-Range."""
+    return f'"{fs.st_mtime_ns:x}-{fs.st_size:x}"'
+
+_hash_etags = {}
+
+def content_etag(path, fs):
+    """Strong ETag from the file's SHA-256, recomputed only when it changes."""
+    key = (fs.st_mtime_ns, fs.st_size)
+    cached = _hash_etags.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            hasher.update(block)
+    etag = f'"{hasher.hexdigest()[:32]}"'
+    _hash_etags[path] = (key, etag)
+    return etag
+
+def compress(data, encoding, fast=False):
+    """Encode `data` as `br` or `gzip`; `fast` trades ratio for latency."""
+    if encoding == "br":
+        return brotli.compress(data, quality=5 if fast else 11)
+    return gzip.compress(data, compresslevel=6 if fast else 9, mtime=0)
+
+def accepted_encodings(header):
+    """Map each item of an Accept-Encoding (or Accept) header to its q-value."""
+    prefs = {}
+    for item in (header or "").split(","):
+        coding, *params = item.strip().split(";")
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding.strip():
+            prefs[coding.strip().lower()] = q
+    return prefs
+
+def choose_encoding(header, available):
+    """Best coding from `available` (server preference order), or None."""
+    prefs = accepted_encodings(header)
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = prefs.get(encoding, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def choose_image_type(header, available):
+    """Best media type from `available` that the Accept header names outright.
+
+    Wildcards don't count: browsers send */* with every image request, and
+    the original format is always acceptable anyway.
+    """
+    prefs = accepted_encodings(header)
+    best, best_q = None, 0.0
+    for ctype in available:
+        q = prefs.get(ctype, 0.0)
+        if q > best_q:
+            best, best_q = ctype, q
+    return best
+
+def fresh_sidecar(path, fs, suffix, stat=os.stat):
+    """The sidecar's stat result if it exists and isn't older than `path`."""
+    try:
+        side = stat(path + suffix)
+    except OSError:
+        return None
+    return side if side.st_mtime_ns >= fs.st_mtime_ns else None
+
+class ByteLRU:
+    """Thread-safe LRU of bytes values bounded by total size, not count."""
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = self.misses = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.items.move_to_end(key)
+            return value
+
+    def pop(self, key):
+        with self.lock:
+            value = self.items.pop(key, None)
+            if value is not None:
+                self.size -= len(value)
+
+    def put(self, key, value):
+        if len(value) > self.budget:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.items[key] = value
+            self.size += len(value)
+            while self.size > self.budget:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+_compressed = ByteLRU(COMPRESS_CACHE_BYTES)
+# Whole-file bytes of small hot files (manifests, pack JSON, card SVGs),
+# keyed by (path, mtime_ns); only used together with a FileIndex.
+_hot = ByteLRU(HOT_CACHE_BYTES)
+
+class FileEntry:
+    __slots__ = ("stat", "ctype")
+
+    def __init__(self, stat):
+        self.stat = stat
+        self.ctype = None
+
+class FileIndex:
+    """Snapshot of every file under the web root, refreshed by mtime polling.
+
+    Lets the handler answer "does it exist, how big, what type, which
+    validator" from memory instead of stat()ing on every request. Files
+    created since the last poll are still found through the filesystem.
+
+    It also remembers request paths that turned out to be missing, so a
+    repeated probe for an optional file is answered without a lookup. Any
+    change seen by scan() forgets them all, since a new file or directory
+    may now satisfy one.
+    """
+    SKIP_DIRS = {".git", "__pycache__", "node_modules"}
+
+    def __init__(self, root, poll_interval=2.0):
+        self.root = os.fspath(root)
+        self.poll_interval = poll_interval
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.listeners = []  # called with each non-empty scan() result
+        self.missing = set()
+        self.generation = 0  # bumped by every scan() that finds changes
+        self.scan()
+
+    def walk(self, top):
+        try:
+            with os.scandir(top) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=True):
+                        if entry.name not in self.SKIP_DIRS:
+                            yield from self.walk(entry.path)
+                    elif entry.is_file(follow_symlinks=True):
+                        try:
+                            yield entry.path, entry.stat()
+                        except OSError:
+                            pass
+        except OSError:
+            pass
+
+    def scan(self):
+        """Re-stat the tree; returns [(path, old_stat_or_None)] that changed."""
+        fresh = dict(self.walk(self.root))
+        old = self.entries
+        changed = [(p, old[p].stat if p in old else None) for p, fs in fresh.items()
+                   if p not in old or (old[p].stat.st_mtime_ns, old[p].stat.st_size)
+                   != (fs.st_mtime_ns, fs.st_size)]
+        changed += [(p, e.stat) for p, e in old.items() if p not in fresh]
+        changed_paths = {p for p, _ in changed}
+        with self.lock:
+            self.entries = {p: FileEntry(fs) if p in changed_paths else old[p]
+                            for p, fs in fresh.items()}
+            if changed:
+                self.generation += 1
+                self.missing = set()
+        for path, fs in changed:
+            if fs is not None:
+                _hot.pop((path, fs.st_mtime_ns))
+        if changed:
+            for listener in self.listeners:
+                listener(changed)
+        return changed
+
+    def poll_forever(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.scan()
+
+    def start_polling(self):
+        threading.Thread(target=self.poll_forever, name="file-index-poll", daemon=True).start()
+
+    def get(self, path):
+        return self.entries.get(path)
+
+    def stat(self, path):
+        entry = self.entries.get(path)
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry.stat
+
+    def update(self, path, fs):
+        """Record a change noticed while serving, ahead of the next poll."""
+        with self.lock:
+            self.entries[path] = FileEntry(fs)
+
+    def is_missing(self, url_path):
+        return url_path in self.missing
+
+    def add_missing(self, url_path, generation):
+        """Remember a 404, unless a scan since `generation` may have undone it."""
+        with self.lock:
+            if generation != self.generation:
+                return
+            if len(self.missing) >= MISSING_MAX:
+                self.missing = set()
+            self.missing.add(url_path)
+
+EVENTS_PATH = "/__events"
+LIVERELOAD_TAG = b'<script src="/assets/js/livereload.js" defer></script>'
+
+class ChangeFeed:
+    """Turns FileIndex changes into Server-Sent Events for --watch.
+
+    Each scan becomes one `change` event per pack with the URL paths that
+    changed, so a page refreshes only what it shows from that pack.
+    Subscribers are callables taking the encoded event.
+    """
+    HEARTBEAT = 15.0
+
+    def __init__(self, root):
+        self.root = os.fspath(root)
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.last_id = 0
+
+    def subscribe(self, push):
+        with self.lock:
+            self.subscribers.add(push)
+
+    def unsubscribe(self, push):
+        with self.lock:
+            self.subscribers.discard(push)
+
+    def publish(self, changed):
+        by_pack = {}
+        for path, _ in changed:
+            if path.endswith(".tmp"):
+                continue
+            url = "/" + os.path.relpath(path, self.root).replace(os.sep, "/")
+            by_pack.setdefault(pack_of(url), []).append(url)
+        with self.lock:
+            subscribers = list(self.subscribers)
+            events = []
+            for pack, paths in sorted(by_pack.items()):
+                self.last_id += 1
+                data = json.dumps({"id": self.last_id, "pack": pack, "paths": sorted(paths)})
+                events.append(f"id: {self.last_id}\nevent: change\ndata: {data}\n\n".encode("utf-8"))
+        for event in events:
+            for push in subscribers:
+                push(event)
+
+def compressed_body(key, read, encoding):
+    """On-the-fly `compress` of `read()`, memoized in the bounded cache."""
+    packed = _compressed.get(key)
+    if packed is None:
+        packed = compress(read(), encoding, fast=True)
+        _compressed.put(key, packed)
+    return packed
+
+def tagged_etag(etag, encoding):
+    """Distinct validator per content-coding, as a strong ETag must be."""
+    return f'{etag[:-1]}-{encoding}"'
+
+BUNDLE_RE = re.compile(r"^packs/([A-Za-z0-9_\-]+)/bundle\.json$")
+# Files pack.json points at by default, and the key holding each list.
+PACK_DATA = {"cards": "cards.json", "stickers": "stickers.json", "tracks": "tracks.json"}
+_bundles = {}
+
+def mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def load_json_list(path, key):
+    """A pack data file as a list, accepting both `[...]` and `{key: [...]}`."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+    items = data if isinstance(data, list) else data.get(key, [])
+    if not isinstance(items, list):
+        raise ValueError(f"{path}: '{key}' is not a list")
+    return items, raw
+
+def pack_bundle(pack_dir):
+    """pack.json merged with its normalized data lists, as served bundle.json.
+
+    Returns (body, mtime, etag) and rebuilds only when an input file changed.
+    Raises OSError/ValueError when pack.json or required data is unusable;
+    tracks are optional, as they are in loader.js.
+    """
+    cached = _bundles.get(pack_dir)
+    if cached and all(mtime_ns(p) == m for p, m in cached[0]):
+        return cached[1]
+
+    pack_path = os.path.join(pack_dir, "pack.json")
+    with open(pack_path, "rb") as f:
+        raw = f.read()
+    pack = json.loads(raw)
+    hasher = hashlib.sha256(raw)
+    inputs = [(pack_path, os.stat(pack_path).st_mtime_ns)]
+    bundle = {"pack": pack}
+    data = pack.get("data") or {}
+    for key, default in PACK_DATA.items():
+        path = os.path.join(pack_dir, data.get(key) or default)
+        try:
+            items, raw = load_json_list(path, key)
+        except FileNotFoundError:
+            if key != "tracks":
+                raise
+            items, raw = [], b""
+        inputs.append((path, mtime_ns(path)))
+        bundle[key] = items
+        hasher.update(b"\0" + key.encode() + b"\0" + raw)
+
+    body = json.dumps(bundle, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    mtime = max(m for _, m in inputs if m) / 1e9
+    result = (body, mtime, f'"b-{hasher.hexdigest()[:32]}"')
+    _bundles[pack_dir] = (inputs, result)
+    return result
+
+CARD_BATCH_RE = re.compile(r"^packs/([A-Za-z0-9_\-]+)/cards\.svg\.json$")
+_card_svgs = {}
+
+def pack_card_svgs(pack_dir):
+    """{card id: (svg text, digest)} for the pack's SVG card art, plus the
+    newest card mtime. Re-read only when cards.json or a card file changed.
+    """
+    _, _, etag = pack_bundle(pack_dir)
+    cached = _card_svgs.get(pack_dir)
+    if cached and cached[0] == etag and all(mtime_ns(p) == m for p, m in cached[1]):
+        return cached[2]
+    root = os.path.normpath(pack_dir)
+    cards, inputs = {}, []
+    for card in json.loads(pack_bundle(pack_dir)[0])["cards"]:
+        if not isinstance(card, dict) or not card.get("id"):
+            continue
+        src = str(card.get("front_svg") or card.get("src") or "")
+        path = os.path.normpath(os.path.join(root, src))
+        if not src.lower().endswith(".svg") or not path.startswith(root + os.sep):
+            continue
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+                fs = os.fstat(f.fileno())
+        except OSError:
+            continue  # the grid falls back to fetching that card on its own
+        inputs.append((path, fs.st_mtime_ns))
+        cards[str(card["id"])] = (raw.decode("utf-8", "replace"), hashlib.sha256(raw).hexdigest()[:16])
+    mtime = max((m for _, m in inputs), default=0) / 1e9
+    _card_svgs[pack_dir] = (etag, inputs, (cards, mtime))
+    return cards, mtime
+
+def card_batch(pack_dir, ids=None):
+    """cards.svg.json as (body, mtime, etag): {"cards": {id: svg markup}}.
+
+    `ids` limits the set to cards the client is still missing (unknown ids
+    are ignored); None means every SVG card. The ETag covers the ids and
+    digests included, so each subset revalidates on its own.
+    """
+    cards, mtime = pack_card_svgs(pack_dir)
+    chosen = sorted(cards if ids is None else set(ids) & cards.keys())
+    hasher = hashlib.sha256()
+    for card_id in chosen:
+        hasher.update(f"{card_id}\0{cards[card_id][1]}\0".encode("utf-8"))
+    body = json.dumps({"cards": {card_id: cards[card_id][0] for card_id in chosen}},
+                      ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, mtime, f'"c-{hasher.hexdigest()[:32]}"'
+
+_summaries = {}
+_full_manifest = {}
+_dir_totals = {}
+# Generated from a pack's sources, or stored next to them; not counted as pack bytes.
+GENERATED_NAMES = {"bundle.json", "cards.svg.json"}
+
+def is_derived(name):
+    """Sidecars (x.js.gz), image variants (x.png.webp) and generated JSON."""
+    stem, ext = os.path.splitext(name.lower())
+    if name in GENERATED_NAMES or ext in {suffix for _, suffix in SIDECARS}:
+        return True
+    return (ext in {suffix for _, suffix in IMAGE_VARIANTS}
+            and os.path.splitext(stem)[1] in RASTER_EXTS)
+
+def dir_bytes(path, generation=None):
+    """Bytes of the files a pack ships, leaving out derived ones.
+
+    With a FileIndex `generation` the total is trusted until the next poll
+    that finds changes; without one (tools, no index) it is re-walked only
+    when a directory or a counted file changed mtime. Either way a replaced
+    MP3 or card shows up even though the bundle hash doesn't move.
+    """
+    cached = _dir_totals.get(path)
+    if cached and generation is not None and cached[2] == generation:
+        return cached[1]
+    if cached and all(mtime_ns(p) == m for p, m in cached[0]):
+        _dir_totals[path] = (cached[0], cached[1], generation)
+        return cached[1]
+    total, inputs = 0, []
+    for root, _, files in os.walk(path):
+        inputs.append((root, mtime_ns(root)))
+        for name in files:
+            if is_derived(name):
+                continue
+            full = os.path.join(root, name)
+            try:
+                fs = os.stat(full)
+            except OSError:
+                continue
+            total += fs.st_size
+            inputs.append((full, fs.st_mtime_ns))
+    _dir_totals[path] = (inputs, total, generation)
+    return total
+
+def pack_summary(pack_dir, entry, generation=None):
+    """Manifest entry with the pack.json and gallery display fields embedded.
+
+    Rebuilt when the pack's bundle hash or its byte total (see dir_bytes)
+    changes.
+    """
+    _, _, etag = pack_bundle(pack_dir)
+    digest = etag.strip('"').removeprefix("b-")[:16]
+    total = dir_bytes(pack_dir, generation)
+    cached = _summaries.get(pack_dir)
+    if cached and cached[0] == (digest, total):
+        return cached[1]
+    bundle = json.loads(pack_bundle(pack_dir)[0])
+    pack = bundle["pack"]
+    summary = dict(entry)
+    summary.update({
+        "name": pack.get("name") or pack.get("title") or entry.get("id"),
+        "tagline": pack.get("tagline", ""),
+        "box_art": (pack.get("assets") or {}).get("box_art", ""),
+        "counts": {key: len(bundle[key]) for key in PACK_DATA},
+        "bytes": total,
+        "hash": digest,
+        "pack": pack,
+    })
+    _summaries[pack_dir] = ((digest, total), summary)
+    return summary
+
+def manifest_full(packs_dir, generation=None):
+    """packs/manifest.full.json as (body, mtime, etag).
+
+    Packs that fail to load keep their bare manifest entry, so the client
+    falls back to fetching that pack.json itself. Given the FileIndex
+    `generation`, a result built in the same generation is returned as is.
+    """
+    cached = _full_manifest.get(packs_dir)
+    if cached and generation is not None and cached[2] == generation:
+        return cached[1]
+    manifest_path = os.path.join(packs_dir, "manifest.json")
+    with open(manifest_path, "rb") as f:
+        raw = f.read()
+    entries = []
+    mtime = os.stat(manifest_path).st_mtime
+    for entry in json.loads(raw).get("packs", []):
+        pack_dir = os.path.join(packs_dir, str(entry.get("packPath", "")).split("/")[0])
+        try:
+            entries.append(pack_summary(pack_dir, entry, generation))
+            mtime = max(mtime, pack_bundle(pack_dir)[1])
+        except (OSError, ValueError, KeyError):
+            entries.append(entry)
+    key = json.dumps([(e.get("hash"), e.get("bytes")) for e in entries]).encode() + raw
+    if cached and cached[0] == key:
+        _full_manifest[packs_dir] = (key, cached[1], generation)
+        return cached[1]
+    body = json.dumps({"packs": entries}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    result = (body, mtime, f'"m-{hashlib.sha256(body).hexdigest()[:32]}"')
+    _full_manifest[packs_dir] = (key, result, generation)
+    return result
+
+AUDIO_EXTS = {".mp3", ".ogg", ".wav", ".m4a"}
+PACK_ID_RE = re.compile(r"^[A-Za-z0-9_\-]+$")
+# Seal stickers preloaded per pack; app.js picks one of the SVG stickers.
+PRELOAD_SEALS = 3
+# Gallery covers preloaded on a plain index.html (above-the-fold boxes).
+PRELOAD_GALLERY = 6
+_preloads = {}
+_gallery_preloads = {}
+
+def is_sticker_card(card):
+    """Same test as isStickerCard in app.js: sticker art mixed into cards.json."""
+    text = " ".join(str(card.get(k) or "") for k in ("id", "front_svg", "src", "title")).lower()
+    return any(marker in text for marker in ("-st-", "_st_", "sticker"))
+
+def pack_asset_path(pack_id, src):
+    """Web path of an asset a pack JSON names, None for remote or empty ones."""
+    if not src or "://" in src:
+        return None
+    return "/packs/" + pack_id + "/" + src.removeprefix("./")
+
+def critical_assets(pack_dir, pack_id):
+    """Web paths a pack page needs first: cover, first card, SVG seals.
+
+    Cached against the pack's bundle hash, so edits to pack.json, cards.json
+    or stickers.json invalidate the list.
+    """
+    body, _, etag = pack_bundle(pack_dir)
+    cached = _preloads.get(pack_dir)
+    if cached and cached[0] == etag:
+        return cached[1]
+    bundle = json.loads(body)
+    srcs = [(bundle["pack"].get("assets") or {}).get("box_art")]
+    cards = [c for c in bundle["cards"] if isinstance(c, dict)]
+    launch = [c for c in cards if not is_sticker_card(c)] or cards
+    if launch:
+        srcs.append(launch[0].get("front_svg") or launch[0].get("src"))
+    seals = [s.get("src") for s in bundle["stickers"]
+             if isinstance(s, dict) and str(s.get("src") or "").lower().endswith(".svg")]
+    srcs += seals[:PRELOAD_SEALS]
+    paths = []
+    for src in srcs:
+        path = pack_asset_path(pack_id, src)
+        if path and path not in paths:
+            paths.append(path)
+    _preloads[pack_dir] = (etag, paths)
+    return paths
+
+def gallery_assets(packs_dir, generation=None):
+    """Box art of the first PRELOAD_GALLERY packs, for a plain index.html.
+
+    Cached against the full manifest's ETag, which manifest_full() itself
+    serves from cache for as long as the FileIndex `generation` holds.
+    """
+    _, _, etag = full = manifest_full(packs_dir, generation)
+    cached = _gallery_preloads.get(packs_dir)
+    if cached and cached[0] == etag:
+        return cached[1]
+    paths = []
+    for entry in json.loads(full[0])["packs"]:
+        pack_id = str(entry.get("packPath", "")).split("/")[0]
+        path = PACK_ID_RE.match(pack_id) and pack_asset_path(pack_id, entry.get("box_art"))
+        if path and path not in paths:
+            paths.append(path)
+    paths = paths[:PRELOAD_GALLERY]
+    _gallery_preloads[packs_dir] = (etag, paths)
+    return paths
+
+def preload_header(paths):
+    return ", ".join(f"<{urllib.parse.quote(p)}>; rel=preload; as=image" for p in paths)
+
+def prefetch_header(paths):
+    return ", ".join(f"<{urllib.parse.quote(p)}>; rel=prefetch" for p in paths)
+
+def request_path(raw):
+    """URL path of a request target, unquoted and without the query."""
+    return urllib.parse.unquote(urllib.parse.urlsplit(raw).path)
+
+def pack_of(url_path):
+    """Pack id of a /packs/<id>/... URL path, "" for everything else."""
+    parts = url_path.split("/")
+    if len(parts) > 3 and parts[1] == "packs" and PACK_ID_RE.match(parts[2]):
+        return parts[2]
+    return ""
+
+class AccessLog:
+    """Append-only JSON-lines access log, one compact object per request.
+
+    Keys: t (unix time), k (client key: hash of address and User-Agent),
+    m, p (path, no query), s (status), b (body bytes), d (ms), r (route).
+    Each line is a single write to an O_APPEND descriptor, so prefork
+    workers can share one file.
+    """
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, record):
+        os.write(self.fd, (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+
+class PrefetchModel:
+    """Next-request predictions written by tools/analyze_access_log.py.
+
+    `packs` maps pack id ("" for site pages) -> {url path: [[next path,
+    probability, bytes], ...]}, most likely first. The file is re-read when
+    its mtime changes, checked at most every CHECK_INTERVAL seconds.
+    """
+    CHECK_INTERVAL = 5.0
+
+    def __init__(self, path, budget, min_probability=0.2):
+        self.path = path
+        self.budget = budget
+        self.min_probability = min_probability
+        self.packs = {}
+        self.mtime = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked < self.CHECK_INTERVAL and self.mtime is not None:
+            return
+        with self.lock:
+            self.checked = now
+            mtime = mtime_ns(self.path)
+            if mtime == self.mtime:
+                return
+            try:
+                with open(self.path, "rb") as f:
+                    self.packs = json.load(f).get("packs", {})
+            except (OSError, ValueError):
+                self.packs = {}
+            self.mtime = mtime
+
+    def hints(self, url_path, size_of, exclude=()):
+        """Likely next paths for url_path whose combined size fits the budget.
+
+        size_of(url_path) returns the current size in bytes, or None when the
+        file is gone; predictions for missing files are dropped.
+        """
+        self.refresh()
+        out, spent = [], 0
+        for target, probability, _ in self.packs.get(pack_of(url_path), {}).get(url_path, ()):
+            if probability < self.min_probability:
+                break
+            if target in exclude:
+                continue
+            size = size_of(target)
+            if size is None or spent + size > self.budget:
+                continue
+            out.append(target)
+            spent += size
+        return out
+
+def route_class(rel):
+    """Coarse route label for metrics; keeps label cardinality bounded."""
+    ext = os.path.splitext(rel)[1].lower()
+    if not rel.startswith("packs/"):
+        return "site"
+    if rel.startswith("packs/manifest"):
+        return "manifest"
+    if ext == ".json":
+        return "pack_json"
+    if ext in AUDIO_EXTS:
+        return "audio"
+    if "/cards/" in rel:
+        return "card"
+    if "/stickers/" in rel:
+        return "sticker"
+    return "pack_asset"
+
+class Metrics:
+    """In-process request metrics rendered in the Prometheus text format."""
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    # Pack ids come from request paths; cap them so probes can't blow up labels.
+    MAX_PACK_LABELS = 64
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}    # (route, status) -> count
+        self.bytes = {}       # route -> body bytes sent
+        self.latency = {}     # route -> [bucket counts..., +Inf count, sum]
+        self.phases = {}      # phase -> seconds
+        self.connections = 0
+        self.packs = {}       # pack -> requests
+        self.not_found = {}   # (pack, source) -> 404s
+        self.caches = {}      # name -> ByteLRU, registered by whoever owns one
+        self.queues = {}      # name -> RequestPool, registered the same way
+
+    def connection(self, delta):
+        with self.lock:
+            self.connections += delta
+
+    def pack_label(self, pack):
+        """`pack` as a label value; ids past MAX_PACK_LABELS share "other"."""
+        pack = pack or "-"
+        if pack in self.packs or len(self.packs) < self.MAX_PACK_LABELS:
+            return pack
+        return "other"
+
+    def observe_pack(self, pack):
+        with self.lock:
+            label = self.pack_label(pack)
+            self.packs[label] = self.packs.get(label, 0) + 1
+
+    def observe_not_found(self, pack, source):
+        """A 404 for a path in `pack`; source is "filesystem" or "negative_cache"."""
+        with self.lock:
+            key = (self.pack_label(pack), source)
+            self.not_found[key] = self.not_found.get(key, 0) + 1
+
+    def observe(self, route, status, nbytes, seconds, timings):
+        with self.lock:
+            key = (route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.bytes[route] = self.bytes.get(route, 0) + nbytes
+            hist = self.latency.setdefault(route, [0] * (len(self.BUCKETS) + 1) + [0.0])
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[len(self.BUCKETS)] += 1
+            hist[-1] += seconds
+            for phase, value in timings.items():
+                self.phases[phase] = self.phases.get(phase, 0.0) + value
+
+    def render(self):
+        out = []
+        def family(name, kind, help_text):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+        with self.lock:
+            family("ev_requests_total", "counter", "Requests answered, by route class and status.")
+            for (route, status), n in sorted(self.requests.items()):
+                out.append(f'ev_requests_total{{route="{route}",status="{status}"}} {n}')
+            family("ev_response_bytes_total", "counter", "Response body bytes, by route class.")
+            for route, n in sorted(self.bytes.items()):
+                out.append(f'ev_response_bytes_total{{route="{route}"}} {n}')
+            family("ev_request_duration_seconds", "histogram", "Time from request to last body byte.")
+            for route, hist in sorted(self.latency.items()):
+                for bound, n in zip(self.BUCKETS, hist):
+                    out.append(f'ev_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {n}')
+                count = hist[len(self.BUCKETS)]
+                out.append(f'ev_request_duration_seconds_bucket{{route="{route}",le="+Inf"}} {count}')
+                out.append(f'ev_request_duration_seconds_sum{{route="{route}"}} {hist[-1]:.6f}')
+                out.append(f'ev_request_duration_seconds_count{{route="{route}"}} {count}')
+            family("ev_phase_seconds_total", "counter", "Time spent per Server-Timing phase.")
+            for phase, value in sorted(self.phases.items()):
+                out.append(f'ev_phase_seconds_total{{phase="{phase}"}} {value:.6f}')
+            family("ev_pack_requests_total", "counter", 'Requests by pack ("-" outside packs/).')
+            for pack, n in sorted(self.packs.items()):
+                out.append(f'ev_pack_requests_total{{pack="{pack}"}} {n}')
+            family("ev_pack_not_found_total", "counter",
+                   "404s by pack and whether the negative cache or a lookup answered.")
+            for (pack, source), n in sorted(self.not_found.items()):
+                out.append(f'ev_pack_not_found_total{{pack="{pack}",source="{source}"}} {n}')
+            family("ev_active_connections", "gauge", "Connections currently open.")
+            out.append(f"ev_active_connections {self.connections}")
+        family("ev_cache_lookups_total", "counter", "In-memory cache lookups, by cache and result.")
+        for name, cache in sorted(self.caches.items()):
+            out.append(f'ev_cache_lookups_total{{cache="{name}",result="hit"}} {cache.hits}')
+            out.append(f'ev_cache_lookups_total{{cache="{name}",result="miss"}} {cache.misses}')
+        family("ev_cache_hit_ratio", "gauge", "hits / (hits + misses) since start.")
+        for name, cache in sorted(self.caches.items()):
+            total = cache.hits + cache.misses
+            out.append(f'ev_cache_hit_ratio{{cache="{name}"}} {cache.hits / total if total else 0:.4f}')
+        family("ev_cache_bytes", "gauge", "Bytes held by each in-memory cache.")
+        for name, cache in sorted(self.caches.items()):
+            out.append(f'ev_cache_bytes{{cache="{name}"}} {cache.size}')
+        if self.queues:
+            family("ev_queue_depth", "gauge", "Requests accepted but not yet picked up, by lane.")
+            for name, pool in sorted(self.queues.items()):
+                for lane, waiting in pool.lanes.items():
+                    out.append(f'ev_queue_depth{{queue="{name}",lane="{lane}"}} {len(waiting)}')
+            family("ev_queue_busy_workers", "gauge", "Pool workers currently handling a request.")
+            for name, pool in sorted(self.queues.items()):
+                out.append(f'ev_queue_busy_workers{{queue="{name}"}} {pool.busy}')
+            family("ev_queue_shed_total", "counter", "Requests turned away with 503 because the queue was full.")
+            for name, pool in sorted(self.queues.items()):
+                out.append(f'ev_queue_shed_total{{queue="{name}"}} {pool.shed}')
+        return ("\n".join(out) + "\n").encode("utf-8")
+
+METRICS = Metrics()
+METRICS.caches.update(hot=_hot, compressed=_compressed)
+
+def cache_policy(rel_path):
+    if FINGERPRINT_RE.search(rel_path):
+        return IMMUTABLE
+    for pattern, value in CACHE_POLICIES:
+        if fnmatch.fnmatch(rel_path, pattern):
+            return value
+    return None
+
+def etag_matches(header, etag):
+    """Weak comparison against an If-None-Match list."""
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+class StaticHandler(SimpleHTTPRequestHandler):
+    """Byte-serving static handler; subclasses decide the caching policy."""
+    # (prefix, offset, length) chunks written by copyfile; None = copy it all
+    body_parts = None
+    body_trailer = b""
+    cache_control = None
+    # FileIndex of the web root, shared by all requests; None = stat per request
+    index = None
+    # per-request bookkeeping for METRICS and Server-Timing
+    started = None
+    route = "other"
+    response_code = None
+    response_length = 0
+    timings = {}
+    # Link: rel=preload paths for this response; 103 Early Hints is opt-in
+    preloads = ()
+    early_hints = False
+    # AccessLog and PrefetchModel shared by all requests; None = disabled
+    access_log = None
+    prefetch = None
+    prefetches = ()
+    # web-root path -> PackArchive entry; members shadow files on disk
+    archive = None
+    # ChangeFeed behind /__events (--watch); None = no live reload
+    feed = None
+
+    def etag_for(self, path, fs):
+        return file_etag(fs)
+
+    def cache_control_for(self, path):
+        return None
+
     def end_headers(self):
-        self.send_header("Cache-Control", "no-store, max-age=0")
+        if self.cache_control:
+            self.send_header("Cache-Control", self.cache_control)
+        if self.preloads and self.response_code in (HTTPStatus.OK, HTTPStatus.PARTIAL_CONTENT):
+            self.send_header("Link", preload_header(self.preloads))
+        if self.prefetches and self.response_code == HTTPStatus.OK:
+            self.send_header("Link", prefetch_header(self.prefetches))
+        if self.timings:
+            self.send_header("Server-Timing", ", ".join(
+                f"{phase};dur={value * 1000:.3f}" for phase, value in self.timings.items()))
         super().end_headers()
 
-if __name__ == "__main__":
-    httpd = ThreadingHTTPServer(("0.0.0.0", PORT), NoCache)
-    print(f"Serving on http://localhost:{PORT}/index.html")
+    def send_response(self, code, message=None):
+        self.response_code = code
+        super().send_response(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == "content-length":
+            self.response_length = int(value)
+        super().send_header(keyword, value)
+
+    def begin_request(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.route, self.response_code, self.response_length = "other", None, 0
+        self.prefetches = ()
+
+    def record_request(self):
+        if self.started is None:
+            return
+        elapsed = time.perf_counter() - self.started
+        timings = dict(self.timings)
+        timings["send"] = max(elapsed - sum(self.timings.values()), 0.0)
+        nbytes = self.response_length if self.command != "HEAD" else 0
+        METRICS.observe(self.route, self.response_code, nbytes, elapsed, timings)
+        if self.route not in ("metrics", "events"):
+            METRICS.observe_pack(pack_of(request_path(self.path)))
+        if self.access_log and self.route != "metrics":
+            client = f"{self.client_address[0]} {self.headers.get('User-Agent', '')}"
+            self.access_log.write({
+                "t": round(time.time(), 3),
+                "k": hashlib.blake2b(client.encode("utf-8", "replace"), digest_size=6).hexdigest(),
+                "m": self.command, "p": request_path(self.path),
+                "s": int(self.response_code or 0), "b": nbytes,
+                "d": round(elapsed * 1000, 2), "r": self.route,
+            })
+        self.started = None
+
+    def do_GET(self):
+        self.begin_request()
+        try:
+            super().do_GET()
+        finally:
+            self.record_request()
+
+    def do_HEAD(self):
+        self.begin_request()
+        try:
+            super().do_HEAD()
+        finally:
+            self.record_request()
+
+    def send_metrics(self):
+        body = METRICS.render()
+        self.route = "metrics"
+        self.cache_control = "no-store"
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return io.BytesIO(body)
+
+    def send_not_found(self, url_path, source):
+        """404 with the precomputed body, skipping send_error's HTML page."""
+        METRICS.observe_not_found(pack_of(url_path), source)
+        self.send_response(HTTPStatus.NOT_FOUND)
+        self.send_header("Content-type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(NOT_FOUND_BODY)))
+        self.end_headers()
+        return io.BytesIO(NOT_FOUND_BODY)
+
+    def send_events(self):
+        """Stream ChangeFeed events until the client goes away."""
+        self.route = "events"
+        self.cache_control = "no-store"
+        self.close_connection = True
+        events = queue.Queue()
+        self.feed.subscribe(events.put)
+        try:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-type", "text/event-stream")
+            self.end_headers()
+            self.wfile.write(b"retry: 1000\n\n")
+            while True:
+                try:
+                    data = events.get(timeout=self.feed.HEARTBEAT)
+                except queue.Empty:
+                    data = b": ping\n\n"
+                self.wfile.write(data)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            self.feed.unsubscribe(events.put)
+        return None
+
+    def send_head(self):
+        t0 = time.perf_counter()
+        self.body_parts, self.body_trailer = None, b""
+        self.cache_control = self.cache_control_for(None)
+        if self.path.split("?", 1)[0] == "/__metrics":
+            return self.send_metrics()
+        if self.feed and request_path(self.path) == EVENTS_PATH:
+            return self.send_events()
+        url = request_path(self.path)
+        if self.index and self.index.is_missing(url):
+            self.route = route_class(url.lstrip("/"))
+            self.timings["lookup"] = time.perf_counter() - t0
+            return self.send_not_found(url, "negative_cache")
+        generation = self.index.generation if self.index else None
+        path = self.translate_path(self.path)
+        self.route = route_class(self.rel_path(path))
+        self.preloads = self.preload_paths(path)
+        if self.preloads:
+            self.send_early_hints()
+        if self.prefetch:
+            self.prefetches = self.prefetch.hints(request_path(self.path), self.url_size,
+                                                  exclude=set(self.preloads))
+        if path.endswith("/") and self.is_file(os.path.join(path, "index.html")):
+            path = os.path.join(path, "index.html")
+        member = self.archive_member(path)
+        virtual = None if member else self.virtual_file(path)
+        if virtual is None and member is None:
+            if path.endswith("/") or not self.is_file(path):
+                self.timings["lookup"] = time.perf_counter() - t0
+                if path.endswith("/") or os.path.isdir(path):
+                    return super().send_head()  # listing or trailing-slash redirect
+                if self.index:
+                    self.index.add_missing(url, generation)
+                return self.send_not_found(url, "filesystem")
+        original = path
+        vary = ["Accept-Encoding"] if os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTS else []
+        variants = self.image_variants(path) if virtual is None else {}
+        if variants:
+            vary.append("Accept")
+            chosen = choose_image_type(self.headers.get("Accept"), variants)
+            if chosen:
+                path = variants[chosen]
+                member = self.archive_member(path)
+        ctype = self.content_type(path)
+        t1 = time.perf_counter()
+        self.timings["lookup"] = t1 - t0
+        try:
+            f, size, mtime, etag, encoding = self.open_representation(path, virtual, member)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        self.timings["read"] = time.perf_counter() - t1
+        try:
+            last_modified = self.date_time_string(mtime)
+            self.cache_control = self.cache_control_for(original)
+            if self.not_modified(etag, mtime):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                if vary:
+                    self.send_header("Vary", ", ".join(vary))
+                self.end_headers()
+                f.close()
+                return None
+
+            ranges = None
+            if self.if_range_matches(etag, mtime):
+                ranges = parse_range(self.headers.get("Range"), size)
+            if ranges == []:
+                f.close()
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+
+            if ranges is None:
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-type", ctype)
+                self.body_parts = [(b"", 0, size)]
+                length = size
+            elif len(ranges) == 1:
+                start, end = ranges[0]
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-type", ctype)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                self.body_parts = [(b"", start, end - start + 1)]
+                length = end - start + 1
+            else:
+                boundary = uuid.uuid4().hex
+                self.body_parts = [
+                    (f"\r\n--{boundary}\r\nContent-Type: {ctype}\r\n"
+                     f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n".encode("latin-1"),
+                     start, end - start + 1)
+                    for start, end in ranges]
+                self.body_trailer = f"\r\n--{boundary}--\r\n".encode("latin-1")
+                self.send_response(HTTPStatus.PARTIAL_CONTENT)
+                self.send_header("Content-type", f"multipart/byteranges; boundary={boundary}")
+                length = (sum(len(p) + n for p, _, n in self.body_parts)
+                          + len(self.body_trailer))
+            self.send_header("Content-Length", str(length))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if vary:
+                self.send_header("Vary", ", ".join(vary))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return f
+        except:
+            f.close()
+            raise
+
+    def preload_paths(self, path):
+        """Critical image paths for bundle.json and index.html responses."""
+        rel = self.rel_path(path)
+        packs_dir = os.path.join(self.directory, "packs")
+        try:
+            match = BUNDLE_RE.match(rel)
+            if match:
+                return critical_assets(os.path.join(packs_dir, match.group(1)), match.group(1))
+            if rel not in ("index.html", "."):
+                return ()
+            # app.js routes with hash fragments the server never sees, so
+            # every index.html gets the gallery's covers.
+            return gallery_assets(packs_dir, self.index.generation if self.index else None)
+        except (OSError, ValueError, KeyError):
+            return ()
+
+    def url_size(self, url_path):
+        """Size of the file behind a URL path, None if there isn't one."""
+        path = self.translate_path(url_path)
+        member = self.archive_member(path)
+        if member:
+            return member["span"][1]
+        try:
+            fs = self.index.stat(path) if self.index else os.stat(path)
+        except OSError:
+            return None
+        return fs.st_size
+
+    def send_early_hints(self):
+        """103 Early Hints; only meaningful to HTTP/1.1 clients of an HTTP/1.1 engine."""
+        if not (self.early_hints and self.protocol_version == "HTTP/1.1"
+                and self.request_version == "HTTP/1.1"):
+            return
+        self.write_early(b"HTTP/1.1 103 Early Hints\r\nLink: "
+                         + preload_header(self.preloads).encode("latin-1") + b"\r\n\r\n")
+
+    def write_early(self, data):
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def rel_path(self, path):
+        return os.path.relpath(path, self.directory).replace(os.sep, "/")
+
+    def virtual_file(self, path):
+        """(body, mtime, etag) for generated endpoints, None for plain files."""
+        rel = self.rel_path(path)
+        if rel == "packs/manifest.full.json":
+            try:
+                return manifest_full(os.path.join(self.directory, "packs"),
+                                     self.index.generation if self.index else None)
+            except (OSError, ValueError) as e:
+                self.log_message("full manifest unavailable: %s", e)
+            return None
+        match = BUNDLE_RE.match(rel)
+        if match:
+            try:
+                return pack_bundle(os.path.join(self.directory, "packs", match.group(1)))
+            except (OSError, ValueError) as e:
+                self.log_message("bundle %s unavailable: %s", match.group(1), e)
+        match = CARD_BATCH_RE.match(rel)
+        if match:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            ids = query["ids"][0].split(",") if "ids" in query else None
+            try:
+                return card_batch(os.path.join(self.directory, "packs", match.group(1)), ids)
+            except (OSError, ValueError) as e:
+                self.log_message("card batch %s unavailable: %s", match.group(1), e)
+        return None
+
+    def open_representation(self, path, virtual=None, member=None):
+        """Open the body to send for `path` after Accept-Encoding negotiation.
+
+        Returns (file, size, mtime, etag, content_coding); the coding is None
+        for the identity representation. `virtual` is a generated
+        (body, mtime, etag) and `member` a PackArchive index entry; either
+        stands in for the file on disk.
+        """
+        if member is not None:
+            encoding = choose_encoding(self.headers.get("Accept-Encoding"),
+                                       [enc for enc, _ in SIDECARS if enc in member])
+            etag = f'"{member["hash"]}"'
+            span = member[encoding] if encoding else member["span"]
+            if encoding:
+                etag = tagged_etag(etag, encoding)
+            return member["archive"].open(span), span[1], member["mtime"], etag, encoding
+        if virtual is not None:
+            data, mtime, etag = virtual
+            encoding = None
+            if (os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTS
+                    and len(data) >= MIN_COMPRESS_SIZE):
+                encoding = choose_encoding(self.headers.get("Accept-Encoding"),
+                                           ["br", "gzip"] if brotli else ["gzip"])
+            if encoding:
+                data = compressed_body((path, etag, encoding), lambda: data, encoding)
+                etag = tagged_etag(etag, encoding)
+            return io.BytesIO(data), len(data), mtime, etag, encoding
+        f, fs = self.open_file(path)
+        try:
+            if (os.path.splitext(path)[1].lower() not in COMPRESSIBLE_EXTS
+                    or fs.st_size < MIN_COMPRESS_SIZE
+                    or "Accept-Encoding" not in self.headers):
+                return f, fs.st_size, fs.st_mtime, self.etag_for(path, fs), None
+            accept = self.headers["Accept-Encoding"]
+            stat = self.index.stat if self.index else os.stat
+            sidecars = {enc: suffix for enc, suffix in SIDECARS
+                        if fresh_sidecar(path, fs, suffix, stat)}
+            encoding = choose_encoding(accept, sidecars)
+            if encoding:
+                side, side_fs = self.open_file(path + sidecars[encoding])
+                f.close()
+                f = side
+                etag = self.etag_for(path + sidecars[encoding], side_fs)
+                return f, side_fs.st_size, fs.st_mtime, tagged_etag(etag, encoding), encoding
+            encoding = choose_encoding(accept, ["br", "gzip"] if brotli else ["gzip"])
+            if not encoding:
+                return f, fs.st_size, fs.st_mtime, self.etag_for(path, fs), None
+            etag = self.etag_for(path, fs)
+            data = compressed_body((path, fs.st_mtime_ns, fs.st_size, encoding),
+                                   f.read, encoding)
+            f.close()
+            return io.BytesIO(data), len(data), fs.st_mtime, tagged_etag(etag, encoding), encoding
+        except:
+            f.close()
+            raise
+
+    def image_variants(self, path):
+        """{media type: path} of the fresh pre-generated variants of a raster image."""
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in RASTER_EXTS:
+            return {}
+        candidates = [(ctype, path + suffix) for ctype, suffix in IMAGE_VARIANTS if suffix != ext]
+        if self.archive_member(path):
+            return {ctype: p for ctype, p in candidates if self.archive_member(p)}
+        stat = self.index.stat if self.index else os.stat
+        try:
+            fs = stat(path)
+        except OSError:
+            return {}
+        return {ctype: p for ctype, p in candidates
+                if fresh_sidecar(path, fs, p[len(path):], stat)}
+
+    def archive_member(self, path):
+        return self.archive.get(self.rel_path(path)) if self.archive else None
+
+    def is_file(self, path):
+        if self.archive_member(path):
+            return True
+        if self.index and self.index.get(path):
+            return True
+        return os.path.isfile(path)
+
+    def content_type(self, path):
+        entry = self.index.get(path) if self.index else None
+        if entry is None:
+            return self.guess_type(path)
+        if entry.ctype is None:
+            entry.ctype = self.guess_type(path)
+        return entry.ctype
+
+    def open_file(self, path):
+        """(file, stat) for `path`.
+
+        With an index, small files are answered from the hot byte cache
+        without touching the filesystem; anything read from disk is checked
+        against the index so a change between polls is never mis-sized.
+        """
+        entry = self.index.get(path) if self.index else None
+        if entry is not None and entry.stat.st_size <= HOT_FILE_MAX:
+            data = _hot.get((path, entry.stat.st_mtime_ns))
+            if data is not None:
+                return io.BytesIO(data), entry.stat
+        f = open(path, "rb")
+        try:
+            fs = os.fstat(f.fileno())
+            if entry is None:
+                return f, fs
+            if (fs.st_mtime_ns, fs.st_size) != (entry.stat.st_mtime_ns, entry.stat.st_size):
+                self.index.update(path, fs)
+            if fs.st_size > HOT_FILE_MAX:
+                return f, fs
+            data = f.read()
+        except:
+            f.close()
+            raise
+        f.close()
+        _hot.put((path, fs.st_mtime_ns), data)
+        return io.BytesIO(data), fs
+
+    def not_modified(self, etag, mtime):
+        """If-None-Match, else If-Modified-Since (RFC 9110 precedence)."""
+        if "If-None-Match" in self.headers:
+            return etag_matches(self.headers["If-None-Match"], etag)
+        if "If-Modified-Since" not in self.headers:
+            return False
+        try:
+            ims = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if ims.tzinfo is None:
+            ims = ims.replace(tzinfo=datetime.timezone.utc)
+        last_modif = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+        return last_modif.replace(microsecond=0) <= ims
+
+    def if_range_matches(self, etag, mtime):
+        """True when Range may be honoured: no If-Range, or it still validates."""
+        value = self.headers.get("If-Range")
+        if not value:
+            return True
+        value = value.strip()
+        if value.startswith(('"', "W/")):
+            return value == etag  # If-Range requires a strong comparison
+        try:
+            date = email.utils.parsedate_to_datetime(value)
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return int(date.timestamp()) == int(mtime)
+
+    def copyfile(self, source, outputfile):
+        if self.body_parts is None:
+            shutil.copyfileobj(source, outputfile)
+            return
+        for prefix, offset, length in self.body_parts:
+            outputfile.write(prefix)
+            if length >= SENDFILE_THRESHOLD and outputfile is self.wfile:
+                # socket.sendfile uses os.sendfile where the platform and the
+                # file allow it and falls back to buffered send() otherwise.
+                self.connection.sendfile(*sendfile_args(source, offset), length)
+            else:
+                copy_range(source, outputfile, offset, length)
+        outputfile.write(self.body_trailer)
+
+class NoCache(StaticHandler):
+    """Dev default: nothing is cached, so edits show up on reload."""
+    cache_control = "no-store, max-age=0"
+
+    def cache_control_for(self, path):
+        return NoCache.cache_control
+
+class Cached(StaticHandler):
+    """Prod mode: content-hash ETags and per-path Cache-Control."""
+    def etag_for(self, path, fs):
+        return content_etag(path, fs)
+
+    def cache_control_for(self, path):
+        if path is None:
+            return None
+        return cache_policy(self.rel_path(path))
+
+class Watch(StaticHandler):
+    """Dev with --watch: validators stay on and everything revalidates, and
+    pages load livereload.js so edits arrive over /__events rather than
+    through no-store."""
+    cache_control = "no-cache"
+
+    def cache_control_for(self, path):
+        return Watch.cache_control
+
+    def virtual_file(self, path):
+        virtual = super().virtual_file(path)
+        if virtual is not None or not path.endswith(".html") or not self.is_file(path):
+            return virtual
+        try:
+            with open(path, "rb") as f:
+                fs = os.fstat(f.fileno())
+                body = f.read()
+        except OSError:
+            return None
+        at = body.lower().rfind(b"</body>")
+        if at < 0:
+            at = len(body)
+        body = body[:at] + LIVERELOAD_TAG + b"\n" + body[at:]
+        return body, fs.st_mtime, f'"w{file_etag(fs)[1:]}'
+
+HANDLERS = {"dev": NoCache, "prod": Cached}
+
+class AsyncServer:
+    """asyncio engine: persistent HTTP/1.1 connections on a single loop.
+
+    Each request is parsed by a detached instance of the normal handler
+    class, whose blocking part (send_head: stat, open, hash, compress) runs
+    in a small thread pool; the body is then streamed with loop.sendfile
+    (os.sendfile, or chunked reads as a fallback), draining between writes
+    so slow clients push back instead of buffering in memory.
+    """
+    KEEPALIVE_TIMEOUT = 75
+    MAX_HEADER_BYTES = 64 * 1024
+    # Request bodies (ignored: only GET/HEAD are served) up to this size are
+    # discarded to keep the connection; anything larger closes it unread.
+    MAX_DISCARD_BYTES = 64 * 1024
+    busy = 0
+
+    def __init__(self, handler_class, directory, max_connections=10000, max_inflight=64, workers=16):
+        self.handler_class = handler_class
+        self.directory = os.fspath(directory)
+        self.max_connections = max_connections
+        self.max_inflight = max_inflight
+        self.workers = workers
+        self.active = 0
+
+    def prepare(self, head, peer, loop=None, writer=None):
+        """Run the handler's request parsing and send_head off the loop.
+
+        Returns (handler, file_or_None); the status line and headers are in
+        handler.wfile. Early hints are queued on `writer` right away, ahead of
+        the final response.
+        """
+        h = self.handler_class.__new__(self.handler_class)
+        if writer is not None:
+            h.write_early = lambda data: loop.call_soon_threadsafe(writer.write, data)
+        h.directory = self.directory
+        h.client_address = peer
+        h.server = self
+        h.protocol_version = "HTTP/1.1"
+        h.close_connection = True
+        h.headers = {}
+        h.wfile = io.BytesIO()
+        line, _, rest = head.partition(b"\r\n")
+        h.raw_requestline = line + b"\r\n"
+        h.rfile = io.BytesIO(rest)
+        if not h.parse_request():
+            return h, None
+        if h.command not in ("GET", "HEAD"):
+            h.send_error(HTTPStatus.NOT_IMPLEMENTED, f"Unsupported method ({h.command!r})")
+            return h, None
+        h.begin_request()
+        f = h.send_head()
+        if f is not None and h.command == "HEAD":
+            f.close()
+            f = None
+        return h, f
+
+    async def send_body(self, loop, writer, h, f):
+        try:
+            if h.body_parts is None:
+                await loop.sendfile(writer.transport, f)
+                return
+            for prefix, offset, length in h.body_parts:
+                if prefix:
+                    writer.write(prefix)
+                    await writer.drain()
+                await loop.sendfile(writer.transport, *sendfile_args(f, offset), length)
+            writer.write(h.body_trailer)
+            await writer.drain()
+        finally:
+            f.close()
+
+    async def stream_events(self, writer):
+        """/__events on the loop itself: an idle stream shouldn't hold a thread."""
+        loop = asyncio.get_running_loop()
+        feed = self.handler_class.feed
+        events = asyncio.Queue()
+
+        def push(data):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, data)
+            except RuntimeError:
+                pass  # loop already closed
+
+        feed.subscribe(push)
+        try:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                         b"Cache-Control: no-store\r\nConnection: close\r\n\r\nretry: 1000\n\n")
+            while not self.stopping.is_set():
+                try:
+                    data = await asyncio.wait_for(events.get(), feed.HEARTBEAT)
+                except asyncio.TimeoutError:
+                    data = b": ping\n\n"
+                writer.write(data)
+                await writer.drain()
+        except asyncio.CancelledError:
+            pass  # loop shutting down with the page still open
+        finally:
+            feed.unsubscribe(push)
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername") or ("", 0)
+        async with self.connections:
+            self.active += 1
+            METRICS.connection(1)
+            try:
+                while not self.stopping.is_set():
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                                                  self.KEEPALIVE_TIMEOUT)
+                    if not head.strip():
+                        continue
+                    target = head.split(b" ", 2)[1:2]
+                    # Matched the way the handler matches it (query ignored), or an
+                    # /__events?since=... would reach send_events() on a buffer.
+                    if (self.handler_class.feed and target
+                            and request_path(target[0].decode("latin-1")) == EVENTS_PATH):
+                        await self.stream_events(writer)
+                        break
+                    async with self.inflight:
+                        self.busy += 1
+                        try:
+                            h, f = await loop.run_in_executor(self.executor, self.prepare, head, peer[:2],
+                                                              loop, writer)
+                            length = h.headers.get("Content-Length", "0")
+                            if ("Transfer-Encoding" in h.headers or not length.isdigit()
+                                    or int(length) > self.MAX_DISCARD_BYTES):
+                                h.close_connection = True
+                            elif int(length):
+                                # small GET/HEAD bodies are read and ignored
+                                await reader.readexactly(int(length))
+                            writer.write(h.wfile.getvalue())
+                            await writer.drain()
+                            if f is not None:
+                                await self.send_body(loop, writer, h, f)
+                            h.record_request()
+                        finally:
+                            self.busy -= 1
+                    if h.close_connection:
+                        break
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                self.active -= 1
+                METRICS.connection(-1)
+                writer.close()
+
+    async def serve(self, host, port, sock=None, drain_timeout=300):
+        """Serve until SIGTERM, then stop accepting and let busy requests finish."""
+        loop = asyncio.get_running_loop()
+        self.connections = asyncio.Semaphore(self.max_connections)
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+        self.stopping = asyncio.Event()
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="serve")
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.stopping.set)
+        except NotImplementedError:
+            pass  # Windows event loops: Ctrl-C still stops the server
+        if sock is not None:
+            server = await asyncio.start_server(self.handle_connection, sock=sock,
+                                                limit=self.MAX_HEADER_BYTES)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port,
+                                                limit=self.MAX_HEADER_BYTES, backlog=1024)
+        await self.stopping.wait()
+        server.close()
+        deadline = time.monotonic() + drain_timeout
+        while self.busy and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+class DrainingHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that counts requests in progress, so a worker
+    being retired can wait for them before exiting."""
+    active = 0
+
+    def __init__(self, *args, **kwargs):
+        self.active_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def process_request_thread(self, request, client_address):
+        with self.active_lock:
+            self.active += 1
+        METRICS.connection(1)
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            METRICS.connection(-1)
+            with self.active_lock:
+                self.active -= 1
+
+    def pending(self):
+        return self.active
+
+def peek_nowait(sock, size):
+    """recv(size, MSG_PEEK) that raises BlockingIOError instead of waiting.
+
+    Switches the socket to non-blocking for the call rather than passing
+    MSG_DONTWAIT, which Windows doesn't have.
+    """
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return sock.recv(size, socket.MSG_PEEK)
+    finally:
+        sock.settimeout(timeout)
+
+def peek_route(sock, wait=None):
+    """route_class() of the request line waiting on sock, without consuming it.
+
+    None when the line hasn't fully arrived (wait=None never blocks) or
+    doesn't look like a request line.
+    """
+    try:
+        if wait is None:
+            data = peek_nowait(sock, 2048)
+        else:
+            sock.settimeout(wait)
+            try:
+                data = sock.recv(2048, socket.MSG_PEEK)
+            finally:
+                sock.settimeout(None)
+    except OSError:
+        return None
+    if b"\r\n" not in data:
+        return None
+    parts = data.split(b"\r\n", 1)[0].split(b" ")
+    if len(parts) != 3:
+        return None
+    path = urllib.parse.urlsplit(parts[1].decode("latin-1")).path
+    return route_class(urllib.parse.unquote(path).lstrip("/"))
+
+class RequestPool:
+    """Fixed worker threads fed from a bounded queue with two lanes.
+
+    Workers always take from "small" (pages, JSON, SVG) before "bulk" (audio),
+    and the first `reserved` workers never take bulk work at all, so card art
+    keeps flowing while every other worker is streaming an MP3. Each lane
+    holds at most `depth` waiting requests; submit() returns False instead of
+    queueing past that, so an audio backlog never sheds card requests.
+    """
+    def __init__(self, handle, workers=32, depth=256, reserved=4):
+        self.handle = handle
+        self.max_depth = depth
+        self.cond = threading.Condition()
+        self.lanes = {"small": deque(), "bulk": deque()}
+        self.busy = 0
+        self.shed = 0
+        reserved = min(reserved, workers - 1)
+        for i in range(workers):
+            threading.Thread(target=self.work, args=(i < reserved,),
+                             name=f"pool-{i}", daemon=True).start()
+
+    def depth(self):
+        return len(self.lanes["small"]) + len(self.lanes["bulk"])
+
+    def submit(self, lane, item, force=False):
+        with self.cond:
+            if not force and len(self.lanes[lane]) >= self.max_depth:
+                self.shed += 1
+                return False
+            self.lanes[lane].append(item)
+            self.cond.notify_all()
+        return True
+
+    def take(self, reserved):
+        with self.cond:
+            while True:
+                if self.lanes["small"]:
+                    item = self.lanes["small"].popleft()
+                elif self.lanes["bulk"] and not reserved:
+                    item = self.lanes["bulk"].popleft()
+                else:
+                    self.cond.wait()
+                    continue
+                self.busy += 1
+                return item
+
+    def work(self, reserved):
+        while True:
+            item = self.take(reserved)
+            try:
+                self.handle(item, reserved)
+            finally:
+                with self.cond:
+                    self.busy -= 1
+
+class IdleParker:
+    """Holds accepted connections that haven't sent anything yet, off the pool.
+
+    One thread waits on all of them with a selector and hands a connection
+    to ready(sock, client_address) once it is readable; one still silent
+    after `timeout` seconds (a browser preconnect, a slowloris) goes to
+    close(sock) instead. park() refuses past `limit` connections.
+    """
+    def __init__(self, ready, close, timeout=15.0, limit=1024):
+        self.ready, self.close = ready, close
+        self.timeout, self.limit = timeout, limit
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.incoming = deque()
+        self.parked = 0
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        threading.Thread(target=self.run, name="idle-parker", daemon=True).start()
+
+    def park(self, sock, client_address):
+        with self.lock:
+            if self.parked >= self.limit:
+                return False
+            self.parked += 1
+            self.incoming.append((sock, client_address, time.monotonic() + self.timeout))
+        try:
+            self.wake_w.send(b"\0")
+        except OSError:
+            pass  # buffer full: the parker is already due to wake
+        return True
+
+    def release(self, key):
+        self.selector.unregister(key.fileobj)
+        with self.lock:
+            self.parked -= 1
+
+    def run(self):
+        while True:
+            events = self.selector.select(timeout=1.0)
+            with self.lock:
+                while self.incoming:
+                    sock, client_address, deadline = self.incoming.popleft()
+                    self.selector.register(sock, selectors.EVENT_READ, (client_address, deadline))
+            for key, _ in events:
+                if key.fileobj is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                    continue
+                self.release(key)
+                self.ready(key.fileobj, key.data[0])
+            now = time.monotonic()
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None and key.data[1] < now:
+                    self.release(key)
+                    self.close(key.fileobj)
+
+class PooledHTTPServer(DrainingHTTPServer):
+    """DrainingHTTPServer that hands connections to a RequestPool instead of
+    starting a thread for each, and answers 503 when the pool's queue is full.
+
+    A connection only reaches the pool once it has sent something: silent
+    ones wait in an IdleParker and are closed after IDLE_TIMEOUT, and a
+    worker gives up on a client that stops sending for READ_TIMEOUT, so
+    idle sockets can't hold every worker. The lane is picked from a peek at
+    the request line; a connection whose line is still incomplete is
+    queued as small and re-sorted by the worker that picks it up.
+    """
+    RETRY_AFTER = 2
+    PEEK_TIMEOUT = 1.0
+    IDLE_TIMEOUT = 15.0
+    READ_TIMEOUT = 15.0
+
+    def __init__(self, *args, workers=32, depth=256, reserved=4, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = RequestPool(self.run_pooled, workers, depth, reserved)
+        self.parker = IdleParker(self.queue_request, self.shutdown_request, self.IDLE_TIMEOUT)
+        METRICS.queues["requests"] = self.pool
+        self.shed_response = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            f"Retry-After: {self.RETRY_AFTER}\r\n"
+            "Cache-Control: no-store\r\n"
+            "Content-Length: 0\r\n"
+            "Connection: close\r\n\r\n").encode("latin-1")
+
+    def process_request(self, request, client_address):
+        if not self.readable(request):
+            if not self.parker.park(request, client_address):
+                self.shed_request(request)
+            return
+        self.queue_request(request, client_address)
+
+    @staticmethod
+    def readable(request):
+        """True once the client has sent something (or hung up)."""
+        try:
+            peek_nowait(request, 1)
+        except BlockingIOError:
+            return False
+        except OSError:
+            pass  # let the handler see the error and clean up
+        return True
+
+    def queue_request(self, request, client_address):
+        route = peek_route(request)
+        lane = None if route is None else ("bulk" if route == "audio" else "small")
+        if not self.pool.submit(lane or "small", (request, client_address, lane)):
+            self.shed_request(request)
+
+    def run_pooled(self, item, reserved):
+        request, client_address, lane = item
+        if lane is None and peek_route(request, self.PEEK_TIMEOUT) == "audio" and reserved:
+            self.pool.submit("bulk", (request, client_address, "bulk"), force=True)
+            return
+        request.settimeout(self.READ_TIMEOUT)
+        self.process_request_thread(request, client_address)
+
+    def shed_request(self, request):
+        # Answered from the accept loop, so never block on the client.
+        try:
+            request.setblocking(False)
+            request.recv(65536)  # unread request bytes would turn close() into a RST
+        except OSError:
+            pass
+        try:
+            request.send(self.shed_response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def pending(self):
+        return self.pool.depth() + self.pool.busy
+
+def reuseport_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+def run_server(args, handler, sock=None, drain_timeout=300, poll=True):
+    """Serve in this process until SIGTERM/Ctrl-C, then drain and return.
+
+    `poll` is False for prefork workers whose supervisor polls the index.
+    """
+    if handler.index and poll:
+        handler.index.start_polling()
+    if args.engine == "asyncio":
+        engine = AsyncServer(handler, os.getcwd(), max_connections=args.max_connections,
+                             max_inflight=args.max_inflight)
+        try:
+            asyncio.run(engine.serve("0.0.0.0", PORT, sock=sock, drain_timeout=drain_timeout))
+        except KeyboardInterrupt:
+            pass
+        return
+    if args.pool > 0:
+        server_class = functools.partial(PooledHTTPServer, workers=args.pool,
+                                         depth=args.queue_depth, reserved=args.reserved)
+    else:
+        server_class = DrainingHTTPServer
+    if sock is None:
+        httpd = server_class(("0.0.0.0", PORT), handler)
+    else:
+        httpd = server_class(sock.getsockname(), handler, bind_and_activate=False)
+        httpd.socket.close()
+        httpd.socket = sock
+        httpd.server_name, httpd.server_port = "localhost", sock.getsockname()[1]
+    signal.signal(signal.SIGTERM,
+                  lambda *_: threading.Thread(target=httpd.shutdown, daemon=True).start())
     try:
-        webbrowser.open(f"http://localhost:{PORT}/index.html")
-    except Exception:
-        pass
-    httpd.serve_forever()
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        httpd.server_close()
+        return
+    httpd.socket.close()
+    deadline = time.monotonic() + drain_timeout
+    while httpd.pending() and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+class Supervisor:
+    """Prefork parent: keeps `count` workers alive and rolls them on SIGHUP
+    or when its own poll of the file index finds changes."""
+    RESTART_BACKOFF = 1.0
+
+    def __init__(self, count, args, handler):
+        self.count = count
+        self.args = args
+        self.handler = handler
+        self.workers = {}  # pid -> (generation, started_at)
+        self.generation = 0
+        self.reload = self.stop = False
+        # With --watch each worker feeds its own event stream, so it polls itself.
+        self.polls_index = handler.index is not None and handler.feed is None
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent coordinates Ctrl-C
+            code = 0
+            try:
+                run_server(self.args, self.handler, sock=reuseport_socket("0.0.0.0", PORT),
+                           poll=not self.polls_index)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = (self.generation, time.monotonic())
+
+    def retire(self, generation_below):
+        for pid, (gen, _) in list(self.workers.items()):
+            if gen < generation_below:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "reload", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "stop", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "stop", True))
+        for _ in range(self.count):
+            self.spawn()
+        print(f"Supervisor {os.getpid()}: {self.count} workers (SIGHUP reloads)")
+        stopping = False
+        next_poll = time.monotonic() + self.handler.index.poll_interval if self.polls_index else None
+        while self.workers:
+            if self.stop and not stopping:
+                stopping = True
+                self.retire(self.generation + 1)
+            if next_poll is not None and time.monotonic() >= next_poll and not stopping:
+                next_poll = time.monotonic() + self.handler.index.poll_interval
+                changed = self.handler.index.scan()
+                if changed:
+                    print(f"Supervisor: {len(changed)} file(s) changed, rolling workers")
+                    self.reload = True
+            if self.reload and not stopping:
+                self.reload = False
+                if self.handler.index:
+                    self.handler.index.scan()
+                self.generation += 1
+                for _ in range(self.count):
+                    self.spawn()
+                self.retire(self.generation)
+                print(f"Supervisor: reloaded, generation {self.generation}")
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            gen, started = self.workers.pop(pid, (None, 0))
+            if gen == self.generation and not stopping:
+                print(f"Supervisor: worker {pid} exited ({status}), restarting")
+                if time.monotonic() - started < self.RESTART_BACKOFF:
+                    time.sleep(self.RESTART_BACKOFF)
+                self.spawn()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EchoValentines static server")
+    parser.add_argument("--mode", choices=sorted(HANDLERS), default="dev",
+                        help="dev sends no-store everywhere; prod enables validators and caching")
+    parser.add_argument("--cache-mb", type=int, default=None,
+                        help="hot-file cache budget; default 64 in prod, 0 (no index) in dev")
+    parser.add_argument("--poll", type=float, default=2.0,
+                        help="seconds between file index mtime polls")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads",
+                        help="threads: ThreadingHTTPServer (HTTP/1.0); asyncio: HTTP/1.1 keep-alive")
+    parser.add_argument("--max-connections", type=int, default=10000,
+                        help="asyncio engine: open connections served at once")
+    parser.add_argument("--max-inflight", type=int, default=64,
+                        help="asyncio engine: requests being answered at once")
+    parser.add_argument("--early-hints", action="store_true",
+                        help="send 103 Early Hints for preloads (asyncio engine, HTTP/1.1 clients)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="prefork this many SO_REUSEPORT worker processes (0 = single process)")
+    parser.add_argument("--pool", type=int, default=32,
+                        help="threads engine: worker threads (0 = one thread per connection, unbounded)")
+    parser.add_argument("--queue-depth", type=int, default=256,
+                        help="threads engine: connections queued per lane before answering 503")
+    parser.add_argument("--reserved", type=int, default=4,
+                        help="threads engine: pool workers kept for non-audio requests")
+    parser.add_argument("--access-log", metavar="PATH",
+                        help="append a JSON-lines record per request (input for tools/analyze_access_log.py)")
+    parser.add_argument("--prefetch", metavar="MODEL",
+                        help="prefetch model from tools/analyze_access_log.py; adds Link: rel=prefetch")
+    parser.add_argument("--prefetch-kb", type=int, default=256,
+                        help="byte budget for the prefetch hints on one response")
+    parser.add_argument("--archive", metavar="PATH", action="append", default=[],
+                        help="serve members of a tools/build_archive.py archive (repeatable)")
+    parser.add_argument("--watch", action="store_true",
+                        help="live reload: keep validators, push file changes to pages over /__events")
+    parser.add_argument("--root", default=".",
+                        help="directory to serve, e.g. dist from tools/build_fingerprints.py")
+    args = parser.parse_args()
+    # Log and model paths are relative to where the server was started.
+    args.access_log = args.access_log and os.path.abspath(args.access_log)
+    args.prefetch = args.prefetch and os.path.abspath(args.prefetch)
+    args.archive = [os.path.abspath(a) for a in args.archive]
+    os.chdir(args.root)
+
+    handler = Watch if args.watch else HANDLERS[args.mode]
+    if args.watch and args.engine == "threads":
+        # Each open page holds its /__events stream for good; don't let
+        # them tie up the request pool.
+        args.pool = 0
+    handler.early_hints = args.early_hints
+    if args.access_log:
+        handler.access_log = AccessLog(args.access_log)
+    if args.prefetch:
+        handler.prefetch = PrefetchModel(args.prefetch, args.prefetch_kb * 1024)
+    if args.archive:
+        handler.archive = {}
+        for path in args.archive:
+            handler.archive.update(PackArchive(path).entries)
+        print(f"Mapped {len(handler.archive)} archive members from {len(args.archive)} file(s)")
+    cache_mb = args.cache_mb if args.cache_mb is not None else (64 if args.mode == "prod" else 0)
+    if cache_mb > 0 or args.watch:
+        _hot.budget = cache_mb * 1024 * 1024
+        # Built before any fork so workers share the scan copy-on-write.
+        handler.index = FileIndex(os.getcwd(), poll_interval=args.poll)
+        print(f"Indexed {len(handler.index.entries)} files, hot cache {cache_mb} MB")
+    if args.watch:
+        handler.feed = ChangeFeed(os.getcwd())
+        handler.index.listeners.append(handler.feed.publish)
+        print(f"Watching for changes every {args.poll}s; pages reload over {EVENTS_PATH}")
+
+    print(f"Serving ({args.mode}, {args.engine}) on http://localhost:{PORT}/index.html")
+    if args.mode == "dev":
+        try:
+            webbrowser.open(f"http://localhost:{PORT}/index.html")
+        except Exception:
+            pass
+    if args.workers > 0:
+        Supervisor(args.workers, args, handler).run()
+    else:
+        run_server(args, handler)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Build the prefetch model for `serve.py --prefetch` from `--access-log` files.
+
+Requests are grouped per client key into sessions (split on idle gaps), and
+every file request counts the next few distinct files the same session asked
+for. The result is, per pack, P(next path | path) for the transitions seen
+often enough to trust, most likely first, with the bytes each target cost.
+Logs may be plain or .gz; pass several to merge workers or days.
+"""
+from __future__ import annotations
+import argparse
+import datetime
+import gzip
+import json
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+# Responses that mean the browser now has the file.
+USEFUL_STATUS = {200, 206, 304}
+
+def read_log(path: Path):
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # a torn last line from a killed worker
+            if rec.get("m") == "GET" and rec.get("s") in USEFUL_STATUS:
+                yield rec
+
+def sessions(records, gap: float):
+    """Per-client request paths, split where the client went idle for `gap`."""
+    by_client = defaultdict(list)
+    for rec in records:
+        by_client[rec["k"]].append(rec)
+    for recs in by_client.values():
+        recs.sort(key=lambda r: r["t"])
+        current, last_t = [], None
+        for rec in recs:
+            if last_t is not None and rec["t"] - last_t > gap:
+                yield current
+                current = []
+            # Range reads of one track arrive as a run of requests; keep one.
+            if not current or current[-1] != rec["p"]:
+                current.append(rec["p"])
+            last_t = rec["t"]
+        if current:
+            yield current
+
+def build_model(paths, gap=1800.0, window=3, min_count=3, min_probability=0.05, top=8):
+    seen = defaultdict(int)                          # path -> times requested
+    follows = defaultdict(lambda: defaultdict(int))  # path -> next path -> count
+    sizes = {}
+    n_sessions = n_requests = 0
+    records = []
+    for path in paths:
+        for rec in read_log(path):
+            records.append(rec)
+            if rec["s"] == 200 and rec.get("b"):
+                sizes[rec["p"]] = rec["b"]
+    for steps in sessions(records, gap):
+        n_sessions += 1
+        n_requests += len(steps)
+        for i, here in enumerate(steps):
+            seen[here] += 1
+            ahead = []
+            for nxt in steps[i + 1:]:
+                if nxt != here and nxt not in ahead:
+                    ahead.append(nxt)
+                    if len(ahead) == window:
+                        break
+            for nxt in ahead:
+                follows[here][nxt] += 1
+
+    packs = defaultdict(dict)
+    for here, counts in follows.items():
+        ranked = sorted(((n / seen[here], nxt) for nxt, n in counts.items()
+                         if n >= min_count and n / seen[here] >= min_probability),
+                        reverse=True)[:top]
+        if ranked:
+            packs[serve.pack_of(here)][here] = [
+                [nxt, round(p, 3), sizes.get(nxt, 0)] for p, nxt in ranked]
+    return {
+        "generated": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "sessions": n_sessions,
+        "requests": n_requests,
+        "packs": {k: dict(sorted(v.items())) for k, v in sorted(packs.items())},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Build serve.py's prefetch model from access logs")
+    parser.add_argument("logs", nargs="+", type=Path, help="access logs written by serve.py --access-log")
+    parser.add_argument("--out", type=Path, default=Path("prefetch-model.json"), help="model file to write")
+    parser.add_argument("--gap", type=float, default=1800.0, help="idle seconds that end a session")
+    parser.add_argument("--window", type=int, default=3, help="following distinct files credited per request")
+    parser.add_argument("--min-count", type=int, default=3, help="ignore transitions seen fewer times")
+    parser.add_argument("--top", type=int, default=8, help="predictions kept per path")
+    args = parser.parse_args()
+
+    missing = [str(p) for p in args.logs if not p.exists()]
+    if missing:
+        print(f"Error: no such log: {', '.join(missing)}")
+        return 1
+    model = build_model(args.logs, gap=args.gap, window=args.window,
+                        min_count=args.min_count, top=args.top)
+    tmp = args.out.with_name(args.out.name + ".tmp")
+    tmp.write_text(json.dumps(model, indent=1) + "\n", encoding="utf-8")
+    tmp.replace(args.out)
+    paths = sum(len(v) for v in model["packs"].values())
+    print(f"Model: {model['sessions']:,} sessions, {model['requests']:,} requests, "
+          f"{paths:,} paths with predictions in {len(model['packs'])} packs -> {args.out}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Replay a realistic visitor mix against a local serve.py and report per-class
+throughput and latency, optionally against a stored baseline.
+
+Each virtual user loops over sessions the way the site's loader does: the
+manifest, one pack's JSON (bundle.json, or the separate files when there is
+no bundle), a grid of card SVGs, the sticker images, and a few MP3 Range
+reads sized and placed from the real files under packs/. Everything stays on
+this machine; --spawn starts its own server so runs are repeatable. Its
+value begins with "--", so pass it as --spawn=... (a bare --spawn= gives the
+defaults).
+
+  python tools/bench_serve.py --spawn="--mode=prod" --users 16 --duration 20
+  python tools/bench_serve.py --url http://127.0.0.1:8092 --save-baseline bench.json
+  python tools/bench_serve.py --spawn="--mode=prod --engine asyncio" --baseline bench.json
+"""
+from __future__ import annotations
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+CLASSES = ("manifest", "pack_json", "card", "sticker", "audio")
+CARD_GRID = 12
+STICKERS = 8
+RANGE_READS = 3
+RANGE_BYTES = 256 * 1024
+
+def card_image(card):
+    return card.get("front_svg") or card.get("src") or ""
+
+def load_plans(root: Path):
+    """Per-pack request plans built from the pack files on disk."""
+    manifest = json.loads((root / "packs" / "manifest.json").read_text(encoding="utf-8"))
+    plans = []
+    for entry in manifest["packs"]:
+        pack_name = entry["packPath"].split("/")[0]
+        pack_dir = root / "packs" / pack_name
+        base = f"/packs/{pack_name}/"
+        try:
+            pack = json.loads((pack_dir / "pack.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        data = pack.get("data") or {}
+        lists = {}
+        for key, default in serve.PACK_DATA.items():
+            try:
+                lists[key], _ = serve.load_json_list(str(pack_dir / (data.get(key) or default)), key)
+            except (OSError, ValueError):
+                lists[key] = []
+        tracks = []
+        for track in lists["tracks"]:
+            path = pack_dir / track.get("src", "")
+            if track.get("src") and path.is_file() and path.stat().st_size:
+                tracks.append((base + track["src"], path.stat().st_size))
+        plans.append({
+            "id": pack_name,
+            "json": [base + "pack.json"] + [base + (data.get(k) or d) for k, d in serve.PACK_DATA.items()],
+            "bundle": base + "bundle.json",
+            "cards": [base + card_image(c) for c in lists["cards"] if card_image(c)][:CARD_GRID],
+            "stickers": [base + s["src"] for s in lists["stickers"] if s.get("src")][:STICKERS],
+            "tracks": tracks,
+        })
+    return plans
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {c: [] for c in CLASSES}   # latency seconds
+        self.bytes = dict.fromkeys(CLASSES, 0)
+        self.errors = dict.fromkeys(CLASSES, 0)
+        self.recording = False
+
+    def add(self, cls, seconds, nbytes, ok):
+        if not self.recording:
+            return
+        with self.lock:
+            self.samples[cls].append(seconds)
+            self.bytes[cls] += nbytes
+            if not ok:
+                self.errors[cls] += 1
+
+class VirtualUser(threading.Thread):
+    def __init__(self, host, port, plans, recorder, stop, seed, think):
+        super().__init__(daemon=True)
+        self.host, self.port = host, port
+        self.plans, self.recorder, self.stop = plans, recorder, stop
+        self.rng = random.Random(seed)
+        self.think = think
+        self.conn = None
+
+    def get(self, cls, path, headers=None, expect=(200,)):
+        """One request; returns (status, body) and records it under `cls`."""
+        if self.stop.is_set():
+            raise EOFError
+        t0 = time.perf_counter()
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.conn.request("GET", urllib.parse.quote(path), headers={
+                "Accept-Encoding": "gzip, br", "User-Agent": "bench_serve", **(headers or {})})
+            resp = self.conn.getresponse()
+            body = resp.read()
+            if resp.will_close:
+                self.conn.close()
+                self.conn = None
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            status, body = 0, b""
+        self.recorder.add(cls, time.perf_counter() - t0, len(body), status in expect)
+        return status, body
+
+    def session(self):
+        status, _ = self.get("manifest", "/packs/manifest.full.json", expect=(200, 404))
+        if status == 404:
+            self.get("manifest", "/packs/manifest.json")
+        plan = self.rng.choice(self.plans)
+        status, _ = self.get("pack_json", plan["bundle"], expect=(200, 404))
+        if status != 200:
+            for path in plan["json"]:
+                self.get("pack_json", path)
+        for path in plan["cards"]:
+            self.get("card", path)
+        for path in plan["stickers"]:
+            self.get("sticker", path)
+        if plan["tracks"]:
+            path, size = self.rng.choice(plan["tracks"])
+            # The first read starts playback; later ones are seeks.
+            starts = [0] + [self.rng.randrange(size) for _ in range(RANGE_READS - 1)]
+            for start in starts:
+                end = min(start + RANGE_BYTES, size) - 1
+                self.get("audio", path, {"Range": f"bytes={start}-{end}"}, expect=(206,))
+        if self.think:
+            self.stop.wait(self.think)
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                self.session()
+        except EOFError:
+            pass
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def class_summary(latencies, errors, nbytes, elapsed):
+    lat = sorted(latencies)
+    return {
+        "requests": len(lat),
+        "errors": errors,
+        "rps": round(len(lat) / elapsed, 1),
+        "p50_ms": round(percentile(lat, 50) * 1000, 2),
+        "p95_ms": round(percentile(lat, 95) * 1000, 2),
+        "p99_ms": round(percentile(lat, 99) * 1000, 2),
+        "bytes_per_s": int(nbytes / elapsed),
+    }
+
+def summarize(recorder, elapsed):
+    results = {cls: class_summary(recorder.samples[cls], recorder.errors[cls],
+                                  recorder.bytes[cls], elapsed)
+               for cls in CLASSES if recorder.samples[cls]}
+    results["all"] = class_summary([x for cls in CLASSES for x in recorder.samples[cls]],
+                                   sum(recorder.errors.values()), sum(recorder.bytes.values()),
+                                   elapsed)
+    return results
+
+def print_report(results, baseline=None):
+    print(f"{'class':<10} {'req':>7} {'err':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'MB/s':>8}")
+    for cls, r in results.items():
+        print(f"{cls:<10} {r['requests']:>7} {r['errors']:>5} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+              f"{r['bytes_per_s'] / 1e6:>8.2f}")
+        base = (baseline or {}).get(cls)
+        if base:
+            deltas = []
+            for key in ("rps", "p95_ms", "bytes_per_s"):
+                if base.get(key):
+                    deltas.append(f"{key} {(r[key] - base[key]) / base[key] * 100:+.1f}%")
+            print(f"{'':<10} vs baseline: {', '.join(deltas)}")
+
+def regressions(results, baseline, tolerance):
+    """Classes whose req/s fell or p95 rose by more than `tolerance` percent."""
+    found = []
+    for cls, r in results.items():
+        base = baseline.get(cls)
+        if not base:
+            continue
+        if base.get("rps") and r["rps"] < base["rps"] * (1 - tolerance / 100):
+            found.append(f"{cls} req/s {base['rps']} -> {r['rps']}")
+        if base.get("p95_ms") and r["p95_ms"] > base["p95_ms"] * (1 + tolerance / 100):
+            found.append(f"{cls} p95 {base['p95_ms']} -> {r['p95_ms']} ms")
+    return found
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def spawn_server(root: Path, serve_args: str):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port))
+    extra = shlex.split(serve_args)
+    if not any(a.startswith("--mode") for a in extra):
+        extra.append("--mode=prod")  # dev mode would open a browser
+    cmd = [sys.executable, str(Path(serve.__file__).resolve()), *extra]
+    proc = subprocess.Popen(cmd, cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit(f"Error: serve.py exited with {proc.returncode}")
+            time.sleep(0.1)
+    proc.terminate()
+    raise SystemExit("Error: serve.py did not start listening")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a local serve.py with a realistic session mix")
+    parser.add_argument("--root", default=".", help="Web root whose packs/ drives the session mix")
+    parser.add_argument("--url", default="http://127.0.0.1:8092", help="Server to test (ignored with --spawn)")
+    parser.add_argument("--spawn", metavar="ARGS", help='start serve.py with these arguments; use the = form, e.g. --spawn="--mode=prod"')
+    parser.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=15.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before measuring")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds each user pauses between sessions")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for pack and seek choices")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a stored results file")
+    parser.add_argument("--save-baseline", metavar="PATH", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="percent req/s drop or p95 rise vs baseline that fails the run")
+    args = parser.parse_args()
+    root = Path(args.root)
+
+    plans = load_plans(root)
+    if not plans:
+        print(f"Error: no loadable packs under {root / 'packs'}")
+        return 1
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))["results"]
+
+    proc = None
+    if args.spawn is not None:
+        proc, port = spawn_server(root, args.spawn)
+        host = "127.0.0.1"
+    else:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    try:
+        recorder, stop = Recorder(), threading.Event()
+        users = [VirtualUser(host, port, plans, recorder, stop, args.seed + i, args.think)
+                 for i in range(args.users)]
+        for user in users:
+            user.start()
+        time.sleep(args.warmup)
+        recorder.recording = True
+        started = time.perf_counter()
+        time.sleep(args.duration)
+        recorder.recording = False
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for user in users:
+            user.join(timeout=35)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    results = summarize(recorder, elapsed)
+    print(f"{args.users} users, {elapsed:.1f}s, {len(plans)} packs, "
+          f"server {'serve.py ' + args.spawn if args.spawn is not None else args.url}")
+    print_report(results, baseline)
+    record = {"users": args.users, "duration": round(elapsed, 2),
+              "server": args.spawn if args.spawn is not None else args.url, "results": results}
+    for out in filter(None, (args.json, args.save_baseline)):
+        Path(out).write_text(json.dumps(record, indent=2) + "\n", encoding="utf-8")
+    if baseline:
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f"  [REGRESSION] {line}")
+        return 1 if found else 0
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
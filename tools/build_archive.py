@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Pack the pack tree into a single archive for `serve.py --archive`, so a deploy
+copies a few files instead of ~1000 and the server maps them once instead of
+opening each asset. Members keep their web-root paths; compressible ones also
+get gzip (and, with the optional `brotli` package, br) variants when that
+saves bytes. Generated bundle.json, cards.svg.json and manifest.full.json are
+included too.
+
+  python tools/build_archive.py                 # packs.evpk with every pack
+  python tools/build_archive.py --per-pack      # packs/<id>.evpk per pack
+
+Rebuilding reuses the compressed variants of unchanged members from the
+previous archive at the same path.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+SKIP_DIRS = {".git", "node_modules", "__pycache__", "audit-results"}
+SKIP_SUFFIXES = {".gz", ".br", ".tmp", ".evpk"}
+
+def iter_members(root: Path, top: Path):
+    """(web-root path, bytes source) for every file under `top`."""
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+        for name in sorted(filenames):
+            path = Path(dirpath, name)
+            if path.suffix.lower() not in SKIP_SUFFIXES:
+                yield path.relative_to(root).as_posix(), path
+
+def generated_members(root: Path, pack_dirs):
+    """Endpoints serve.py would otherwise generate from files now archived."""
+    # The archived cards.svg.json is the full set; `?ids=` subsets need disk.
+    generators = [("bundle.json", serve.pack_bundle), ("cards.svg.json", serve.card_batch)]
+    for pack_dir in pack_dirs:
+        for name, generate in generators:
+            rel = (pack_dir / name).relative_to(root).as_posix()
+            if (pack_dir / name).exists() or not (pack_dir / "pack.json").exists():
+                continue
+            try:
+                body, mtime, _ = generate(str(pack_dir))
+            except (OSError, ValueError) as e:
+                print(f"  [ERROR] {pack_dir.name}/{name}: {e}")
+                continue
+            yield rel, body, mtime
+
+def previous_variants(out: Path) -> dict:
+    """hash -> {encoding: bytes} from the archive being replaced."""
+    try:
+        old = serve.PackArchive(str(out))
+    except (OSError, ValueError):
+        return {}
+    variants = {}
+    for entry in old.entries.values():
+        for encoding, _ in serve.SIDECARS:
+            if encoding in entry:
+                offset, length = entry[encoding]
+                variants.setdefault(entry["hash"], {})[encoding] = bytes(old.view[offset:offset + length])
+    old.view.release()
+    old.map.close()
+    old.file.close()
+    return variants
+
+class ArchiveWriter:
+    def __init__(self, out: Path, reuse: dict):
+        self.out = out
+        self.tmp = out.with_name(out.name + ".tmp")
+        self.f = open(self.tmp, "wb")
+        self.f.write(serve.ARCHIVE_HEADER.pack(serve.ARCHIVE_MAGIC, 0, 0))
+        self.files = {}
+        self.reuse = reuse
+        self.raw_bytes = self.stored_bytes = 0
+
+    def put_bytes(self, data: bytes):
+        offset = self.f.tell()
+        self.f.write(data)
+        self.stored_bytes += len(data)
+        return [offset, len(data)]
+
+    def add(self, rel: str, data: bytes, mtime: float):
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        entry = {"span": self.put_bytes(data), "hash": digest, "mtime": mtime}
+        self.raw_bytes += len(data)
+        if os.path.splitext(rel)[1].lower() in serve.COMPRESSIBLE_EXTS and len(data) >= serve.MIN_COMPRESS_SIZE:
+            for encoding, _ in serve.SIDECARS:
+                if encoding == "br" and not serve.brotli:
+                    continue
+                packed = self.reuse.get(digest, {}).get(encoding) or serve.compress(data, encoding)
+                if len(packed) < len(data):
+                    entry[encoding] = self.put_bytes(packed)
+        self.files[rel] = entry
+
+    def finish(self):
+        index = json.dumps({"version": 1, "files": self.files}, separators=(",", ":")).encode("utf-8")
+        offset = self.f.tell()
+        self.f.write(index)
+        self.f.seek(0)
+        self.f.write(serve.ARCHIVE_HEADER.pack(serve.ARCHIVE_MAGIC, offset, len(index)))
+        self.f.close()
+        os.replace(self.tmp, self.out)
+
+def build(root: Path, tops, out: Path):
+    writer = ArchiveWriter(out, previous_variants(out))
+    pack_dirs = []
+    for top in tops:
+        pack_dirs += [top] if (top / "pack.json").exists() else sorted(
+            p for p in top.iterdir() if (p / "pack.json").exists())
+        for rel, path in iter_members(root, top):
+            writer.add(rel, path.read_bytes(), path.stat().st_mtime)
+    for rel, body, mtime in generated_members(root, pack_dirs):
+        writer.add(rel, body, mtime)
+    packs = root / "packs"
+    if packs in tops and (packs / "manifest.json").exists() and "packs/manifest.full.json" not in writer.files:
+        body, mtime, _ = serve.manifest_full(str(packs))
+        writer.add("packs/manifest.full.json", body, mtime)
+    writer.finish()
+    print(f"  {out}: {len(writer.files)} members, {writer.raw_bytes:,} bytes "
+          f"({writer.stored_bytes:,} stored with variants)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build pack archives for serve.py --archive")
+    parser.add_argument("--root", default=".", help="Web root the member paths are relative to")
+    parser.add_argument("--out", default="packs.evpk", help="Archive to write (whole tree)")
+    parser.add_argument("--per-pack", action="store_true",
+                        help="Write packs/<id>.evpk for each pack instead of one archive")
+    args = parser.parse_args()
+    root = Path(args.root)
+    packs = root / "packs"
+
+    if not packs.is_dir():
+        print(f"Error: {packs} not found")
+        return 1
+    if not serve.brotli:
+        print("Note: brotli not installed, archiving gzip variants only (pip install brotli)")
+    if args.per_pack:
+        for pack_dir in sorted(p for p in packs.iterdir() if (p / "pack.json").exists()):
+            build(root, [pack_dir], packs / f"{pack_dir.name}.evpk")
+    else:
+        build(root, [packs], Path(args.out))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
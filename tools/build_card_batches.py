@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Write packs/<id>/cards.svg.json (every SVG card of the pack in one JSON map)
+for static/CDN hosting where serve.py isn't there to generate it. A static
+host ignores the `?ids=` query loader.js sends and returns the full set,
+which the client accepts just the same.
+Re-run after editing card art; unchanged files are left untouched.
+"""
+from __future__ import annotations
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+def main():
+    packs_dir = Path("packs")
+    manifest_path = packs_dir / "manifest.json"
+
+    if not manifest_path.exists():
+        print("Error: packs/manifest.json not found")
+        return 1
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    written = unchanged = failed = 0
+    for pack_entry in manifest["packs"]:
+        pack_dir = packs_dir / pack_entry["packPath"].split("/")[0]
+        try:
+            body, _, etag = serve.card_batch(str(pack_dir))
+        except (OSError, ValueError) as e:
+            print(f"  [ERROR] {pack_dir.name}: {e}")
+            failed += 1
+            continue
+        out = pack_dir / "cards.svg.json"
+        if out.exists() and out.read_bytes() == body:
+            unchanged += 1
+            continue
+        out.write_bytes(body)
+        print(f"  [UPDATED] {out} {etag} ({len(body):,} bytes)")
+        written += 1
+
+    print(f"Card batches: {written} written, {unchanged} unchanged, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Build a deployable copy of the site (default dist/) in which every pack asset
+also exists under a content-hashed name (assets/cards/ac-01.3f9a1c2e.svg) and
+the pack's cards/stickers/tracks lists and pack.json "assets" block point at
+those names. serve.py --mode=prod --root dist sends hashed paths as immutable,
+so returning visitors only revalidate manifests and pack JSON.
+
+Files are hard-linked into the output where possible; JSON that gets rewritten
+is always replaced, never written through a link. Sidecars and image variants
+(name.svg.gz, name.webp.avif) are placed next to the hashed name as well, so
+serve.py can still negotiate them. dist/packs/asset-map.json records every
+original -> hashed path. Digests are cached by size and mtime, so re-runs only
+hash what changed, and hashed files no longer referenced are pruned.
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+SKIP_DIRS = {".git", "node_modules", "__pycache__", "audit-results"}
+HASH_LEN = 8
+CACHE_NAME = ".fingerprints.json"
+MAP_NAME = "packs/asset-map.json"
+# Generated from the rewritten JSON in the output rather than copied.
+GENERATED = {"bundle.json", "cards.svg.json", "manifest.full.json"}
+# Sidecars and image variants follow their original to its hashed name.
+DERIVED_SUFFIXES = {suffix for _, suffix in serve.SIDECARS + serve.IMAGE_VARIANTS}
+
+def iter_site(root: Path):
+    """Yield web-root-relative paths of everything the site serves."""
+    for name in sorted(os.listdir(root)):
+        if name.endswith(".html") and (root / name).is_file():
+            yield name
+    for top in ("assets", "packs"):
+        for dirpath, dirnames, filenames in os.walk(root / top):
+            dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS)
+            for name in sorted(filenames):
+                rel = Path(dirpath, name).relative_to(root).as_posix()
+                yield rel
+
+def fingerprint_name(rel: str, digest: str) -> str:
+    stem, ext = os.path.splitext(rel)
+    return f"{stem}.{digest[:HASH_LEN]}{ext}"
+
+def file_digest(path: Path, fs: os.stat_result, cache: dict) -> str:
+    key = str(path)
+    cached = cache.get(key)
+    if cached and cached[0] == fs.st_size and cached[1] == fs.st_mtime_ns:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    cache[key] = [fs.st_size, fs.st_mtime_ns, digest]
+    return digest
+
+def place(src: Path, dst: Path) -> bool:
+    """Hard-link (or copy) src to dst unless dst already has its content."""
+    fs = src.stat()
+    try:
+        ds = dst.stat()
+    except FileNotFoundError:
+        ds = None
+    if ds and (ds.st_ino == fs.st_ino and ds.st_dev == fs.st_dev
+               or ds.st_size == fs.st_size and ds.st_mtime_ns == fs.st_mtime_ns):
+        return False
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".tmp")
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return True
+
+def write_replacing(dst: Path, body: bytes) -> bool:
+    if dst.exists() and dst.read_bytes() == body and dst.stat().st_nlink == 1:
+        return False
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(dst.name + ".tmp")
+    tmp.write_bytes(body)
+    os.replace(tmp, dst)
+    return True
+
+def rewrite_refs(value, mapping: dict):
+    """Replace every string equal to a pack-relative asset path."""
+    if isinstance(value, str):
+        return mapping.get(value.removeprefix("./"), value)
+    if isinstance(value, list):
+        return [rewrite_refs(v, mapping) for v in value]
+    if isinstance(value, dict):
+        return {k: rewrite_refs(v, mapping) for k, v in value.items()}
+    return value
+
+def dump_json(obj) -> bytes:
+    return (json.dumps(obj, indent=2, ensure_ascii=False) + "\n").encode("utf-8")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a fingerprinted copy of the site")
+    parser.add_argument("--root", default=".", help="Web root to read")
+    parser.add_argument("--out", default="dist", help="Output directory")
+    args = parser.parse_args()
+    root, out = Path(args.root).resolve(), Path(args.out).resolve()
+    if out == root or root in out.parents and out.relative_to(root).parts[0] in ("assets", "packs"):
+        print(f"Error: output {out} would overlap the site tree")
+        return 1
+
+    cache_path = out / CACHE_NAME
+    try:
+        cache = json.loads(cache_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+
+    site = list(iter_site(root))
+    pack_dirs = sorted({rel.rsplit("/", 1)[0] for rel in site
+                        if rel.startswith("packs/") and rel.endswith("/pack.json")})
+    rewritten = set()
+    for pack_dir in pack_dirs:
+        try:
+            pack = json.loads((root / pack_dir / "pack.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        data = pack.get("data") or {}
+        rewritten.add(f"{pack_dir}/pack.json")
+        for key, default in serve.PACK_DATA.items():
+            rewritten.add(f"{pack_dir}/{data.get(key) or default}")
+
+    linked = hashed = 0
+    asset_map = {}
+    derived = []
+    site_set = set(site)
+    for rel in site:
+        name = rel.rsplit("/", 1)[-1]
+        if rel in rewritten or name in GENERATED or name.endswith(".tmp"):
+            continue
+        src = root / rel
+        linked += place(src, out / rel)
+        base, suffix = os.path.splitext(rel)
+        if suffix.lower() in DERIVED_SUFFIXES and base in site_set:
+            derived.append((base, suffix))
+            continue
+        pack_dir = next((p for p in pack_dirs if rel.startswith(p + "/")), None)
+        if pack_dir is None or src.suffix.lower() == ".json" or serve.FINGERPRINT_RE.search(rel):
+            continue
+        target = fingerprint_name(rel, file_digest(src, src.stat(), cache))
+        hashed += place(src, out / target)
+        asset_map[rel] = target
+    live = set(asset_map.values())
+    for base, suffix in derived:
+        if base in asset_map:
+            hashed += place(root / (base + suffix), out / (asset_map[base] + suffix))
+            live.add(asset_map[base] + suffix)
+
+    written = 0
+    for pack_dir in pack_dirs:
+        prefix = pack_dir + "/"
+        mapping = {k[len(prefix):]: v[len(prefix):]
+                   for k, v in asset_map.items() if k.startswith(prefix)}
+        for rel in sorted(r for r in rewritten if r.startswith(prefix)):
+            src = root / rel
+            if not src.exists():
+                continue
+            obj = json.loads(src.read_text(encoding="utf-8"))
+            if rel.endswith("/pack.json"):
+                if isinstance(obj.get("assets"), dict):
+                    obj["assets"] = rewrite_refs(obj["assets"], mapping)
+            else:
+                obj = rewrite_refs(obj, mapping)
+            written += write_replacing(out / rel, dump_json(obj))
+        if (root / pack_dir / "bundle.json").exists():
+            body, _, _ = serve.pack_bundle(str(out / pack_dir))
+            written += write_replacing(out / pack_dir / "bundle.json", body)
+        if (root / pack_dir / "cards.svg.json").exists():
+            body, _, _ = serve.card_batch(str(out / pack_dir))
+            written += write_replacing(out / pack_dir / "cards.svg.json", body)
+    if (root / "packs" / "manifest.full.json").exists():
+        body, _, _ = serve.manifest_full(str(out / "packs"))
+        written += write_replacing(out / "packs" / "manifest.full.json", body)
+
+    # Hashed names from earlier builds that nothing points at any more.
+    pruned = 0
+    for rel in iter_site(out):
+        hashed_name = serve.FINGERPRINT_RE.search(rel) or serve.FINGERPRINT_RE.search(os.path.splitext(rel)[0])
+        if hashed_name and rel not in live and not (root / rel).exists():
+            (out / rel).unlink()
+            pruned += 1
+
+    write_replacing(out / MAP_NAME, dump_json(dict(sorted(asset_map.items()))))
+    cache = {k: v for k, v in cache.items() if Path(k).exists()}
+    cache_path.write_text(json.dumps(cache), encoding="utf-8")
+    print(f"Fingerprints: {len(asset_map)} assets ({hashed} new), {linked} files placed, "
+          f"{written} JSON rewritten, {pruned} stale removed -> {out}")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
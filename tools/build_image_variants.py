@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Write AVIF/WebP variants next to raster images (name.webp.avif, name.png.webp)
+for serve.py to negotiate with the browser's Accept header. Pack JSON keeps
+pointing at the originals. Variants inherit the source mtime, so unchanged
+images are skipped on re-runs, and a variant that isn't smaller than its
+original is not kept. Encoding uses ffmpeg, as tools/convert_images.py does.
+"""
+from __future__ import annotations
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+SKIP_DIRS = {".git", "node_modules", "__pycache__", "audit-results"}
+# ffmpeg output options per variant suffix.
+ENCODERS = {
+    ".avif": ["-c:v", "libaom-av1", "-still-picture", "1", "-crf", "32", "-f", "avif"],
+    ".webp": ["-c:v", "libwebp", "-quality", "80", "-f", "webp"],
+}
+
+def iter_rasters(root: Path):
+    variant_suffixes = {suffix for _, suffix in serve.IMAGE_VARIANTS}
+    for top in ("packs", "assets"):
+        for dirpath, dirnames, filenames in os.walk(root / top):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+            for name in filenames:
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in serve.RASTER_EXTS:
+                    continue
+                # name.png.webp is itself a variant, not a source
+                if ext.lower() in variant_suffixes and os.path.splitext(stem)[1].lower() in serve.RASTER_EXTS:
+                    continue
+                yield Path(dirpath) / name
+
+def build_variant(src: Path, suffix: str, force: bool = False) -> str:
+    """Write one variant; returns 'written', 'fresh', 'skipped', 'removed' or 'failed'."""
+    fs = src.stat()
+    variant = Path(str(src) + suffix)
+    if not force and serve.fresh_sidecar(str(src), fs, suffix):
+        return "fresh"
+    tmp = variant.with_name(variant.name + ".tmp")
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(src), *ENCODERS[suffix], str(tmp)]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0 or not tmp.exists():
+        print(f"  [ERROR] {src}{suffix}: {result.stderr.decode(errors='replace').strip()}")
+        tmp.unlink(missing_ok=True)
+        return "failed"
+    if tmp.stat().st_size >= fs.st_size:
+        # Not worth it; a stale variant would otherwise keep being served.
+        tmp.unlink()
+        if variant.exists():
+            variant.unlink()
+            return "removed"
+        return "skipped"
+    os.utime(tmp, ns=(fs.st_atime_ns, fs.st_mtime_ns))
+    os.replace(tmp, variant)
+    return "written"
+
+def clean(root: Path) -> int:
+    removed = 0
+    for src in iter_rasters(root):
+        for _, suffix in serve.IMAGE_VARIANTS:
+            variant = Path(str(src) + suffix)
+            if variant.exists():
+                variant.unlink()
+                removed += 1
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Build AVIF/WebP image variants for serve.py")
+    parser.add_argument("--root", default=".", help="Web root to process")
+    parser.add_argument("--formats", default="avif,webp", help="Comma-separated variant formats")
+    parser.add_argument("--force", action="store_true", help="Rebuild even up-to-date variants")
+    parser.add_argument("--clean", action="store_true", help="Delete variants instead of building them")
+    args = parser.parse_args()
+    root = Path(args.root)
+
+    if args.clean:
+        print(f"Removed {clean(root)} image variants")
+        return 0
+    if not shutil.which("ffmpeg"):
+        print("Error: ffmpeg not found on PATH")
+        return 1
+
+    suffixes = ["." + f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    unknown = [s for s in suffixes if s not in ENCODERS]
+    if unknown:
+        print(f"Error: unsupported format(s): {', '.join(s[1:] for s in unknown)}")
+        return 1
+
+    counts = {"written": 0, "fresh": 0, "skipped": 0, "removed": 0, "failed": 0}
+    for src in iter_rasters(root):
+        for suffix in suffixes:
+            if src.suffix.lower() != suffix:
+                counts[build_variant(src, suffix, force=args.force)] += 1
+
+    print(f"Variants: {counts['written']} written, {counts['fresh']} up to date, "
+          f"{counts['skipped']} not smaller, {counts['removed']} stale removed, "
+          f"{counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
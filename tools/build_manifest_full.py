@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Write packs/manifest.full.json: the pack manifest with each pack.json and its
+gallery summary (name, tagline, box art, counts, bytes, hash) embedded.
+Byte totals leave out sidecars, image variants and generated JSON, so they
+don't depend on which build tools have run; the file is only rewritten when
+something changed.
+"""
+from __future__ import annotations
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+def main():
+    packs_dir = Path("packs")
+    out = packs_dir / "manifest.full.json"
+
+    if not (packs_dir / "manifest.json").exists():
+        print("Error: packs/manifest.json not found")
+        return 1
+
+    body, _, etag = serve.manifest_full(str(packs_dir))
+    missing = [e.get("id") for e in json.loads(body)["packs"] if "pack" not in e]
+    for pack_id in missing:
+        print(f"  [ERROR] {pack_id}: pack could not be loaded, left as a bare entry")
+
+    if out.exists() and out.read_bytes() == body:
+        print(f"[OK] {out} unchanged {etag}")
+    else:
+        out.write_bytes(body)
+        print(f"[UPDATED] {out} {etag} ({len(body):,} bytes)")
+    return 1 if missing else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
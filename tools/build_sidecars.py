@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Write precompressed .gz/.br sidecars next to text assets for serve.py.
+Sidecars inherit the source mtime, so unchanged files are skipped on re-runs.
+Brotli sidecars need the optional `brotli` package; gzip ones always work.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import serve  # noqa: E402
+
+SKIP_DIRS = {".git", "node_modules", "__pycache__", "audit-results"}
+
+def iter_text_assets(root: Path):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            if os.path.splitext(name)[1].lower() in serve.COMPRESSIBLE_EXTS:
+                yield Path(dirpath) / name
+
+def build_sidecar(src: Path, encoding: str, suffix: str, force: bool = False) -> str:
+    """Write one sidecar; returns 'written', 'fresh', 'skipped' or 'removed'."""
+    fs = src.stat()
+    sidecar = Path(str(src) + suffix)
+    if not force and serve.fresh_sidecar(str(src), fs, suffix):
+        return "fresh"
+    data = src.read_bytes()
+    packed = serve.compress(data, encoding)
+    if fs.st_size < serve.MIN_COMPRESS_SIZE or len(packed) >= len(data):
+        # Not worth it; a stale sidecar would otherwise keep being served.
+        if sidecar.exists():
+            sidecar.unlink()
+            return "removed"
+        return "skipped"
+    tmp = sidecar.with_name(sidecar.name + ".tmp")
+    tmp.write_bytes(packed)
+    os.utime(tmp, ns=(fs.st_atime_ns, fs.st_mtime_ns))
+    os.replace(tmp, sidecar)
+    return "written"
+
+def clean(root: Path) -> int:
+    removed = 0
+    for src in iter_text_assets(root):
+        for _, suffix in serve.SIDECARS:
+            sidecar = Path(str(src) + suffix)
+            if sidecar.exists():
+                sidecar.unlink()
+                removed += 1
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(description="Build precompressed sidecars for serve.py")
+    parser.add_argument("--root", default=".", help="Web root to process")
+    parser.add_argument("--force", action="store_true", help="Rebuild even up-to-date sidecars")
+    parser.add_argument("--clean", action="store_true", help="Delete sidecars instead of building them")
+    args = parser.parse_args()
+    root = Path(args.root)
+
+    if args.clean:
+        print(f"Removed {clean(root)} sidecars")
+        return 0
+
+    encodings = [(enc, suffix) for enc, suffix in serve.SIDECARS
+                 if enc != "br" or serve.brotli]
+    if not serve.brotli:
+        print("Note: brotli not installed, writing .gz sidecars only (pip install brotli)")
+
+    counts = {"written": 0, "fresh": 0, "skipped": 0, "removed": 0}
+    raw_bytes = packed_bytes = 0
+    for src in iter_text_assets(root):
+        for encoding, suffix in encodings:
+            counts[build_sidecar(src, encoding, suffix, force=args.force)] += 1
+        gz = Path(str(src) + ".gz")
+        if gz.exists():
+            raw_bytes += src.stat().st_size
+            packed_bytes += gz.stat().st_size
+
+    print(f"Sidecars: {counts['written']} written, {counts['fresh']} up to date, "
+          f"{counts['skipped']} not worth compressing, {counts['removed']} stale removed")
+    if packed_bytes:
+        print(f"gzip: {raw_bytes:,} -> {packed_bytes:,} bytes ({raw_bytes / packed_bytes:.1f}x)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())